@@ -0,0 +1,231 @@
+import hashlib
+import inspect
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelEncoder
+
+###############################################
+# Chargement et préparation du jeu de données #
+###############################################
+
+FICHIER_CSV = 'data_2012-2015.csv'
+DOSSIER_CACHE = Path(__file__).resolve().parents[2] / "data" / "processed"
+
+LISTE_CBR = {"GO":"Gazole",
+            "ES":"Essence",
+            "EH":"Essence",
+            "GH":"Gazole",
+            "ES/GN":"Essence",
+            "GN/ES":"Gaz Naturel Vehicule (GNV)",
+            "ES/GP":"Essence",
+            "GP/ES":"Gaz de Petrole Liquefié (GPL)",
+            "EL":"Electrique",
+            "GN":"Gaz Naturel Vehicule (GNV)",
+            "EE":"Essence",
+            "FE":"SuperEthanol-E85",
+            "GL":"Gazole"}
+
+CIBLE = "CO2 (g/km)"
+COLONNES = ["Consommation mixte (l/100km)", "Carburant", CIBLE, "Puissance administrative", "masse vide euro min (kg)"]
+FEATURES_DT = ["Consommation mixte (l/100km)", "Carburant", "Puissance administrative", "masse vide euro min (kg)"]
+FEATURES_NUM = ["Consommation mixte (l/100km)", "Puissance administrative", "masse vide euro min (kg)"]
+
+
+def empreinte_fichier(file, taille_bloc=1 << 20):
+    # Empreinte du contenu du CSV : change dès que les données changent
+    h = hashlib.sha1()
+    with open(file, "rb") as f:
+        for bloc in iter(lambda: f.read(taille_bloc), b""):
+            h.update(bloc)
+    return h.hexdigest()[:16]
+
+
+def preprocessing(df_original):
+    df = df_original[COLONNES].copy()
+    df["Carburant"] = df["Carburant"].replace(LISTE_CBR)
+    df = df.dropna(how="any")
+
+    # Variables indicatrices du carburant (pour le réseau de neurones et le modèle custom)
+    df_carb = pd.get_dummies(df["Carburant"]).astype("int64")
+
+    df["Carburant"] = LabelEncoder().fit_transform(df["Carburant"])
+
+    return pd.concat([df, df_carb], axis=1).reset_index(drop=True)
+
+
+def colonnes_carburant(colonnes):
+    # Les indicatrices sont toutes les colonnes ajoutées après les colonnes du modèle
+    return [c for c in colonnes if c not in COLONNES]
+
+
+#########################################
+# Publication en buffers Arrow partagés #
+#########################################
+
+# Le jeu de données est écrit une seule fois au format Arrow IPC (non compressé)
+# puis mappé en mémoire par chaque session Streamlit ou processus de calcul :
+# les pages sont partagées par le cache du système, la mémoire résidente ne
+# croît pas avec le nombre d'utilisateurs.
+
+def ecriture_arrow(df, chemin):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Les flottants sont écrits avec NaN et sans masque de nullité : une colonne
+    # avec des valeurs nulles serait recopiée (donc privée) dans chaque processus
+    for i, col in enumerate(df.columns):
+        if df[col].dtype.kind == "f":
+            table = table.set_column(i, col, pa.array(df[col].to_numpy(), from_pandas=False))
+    table = table.combine_chunks()
+    tmp = chemin.with_name(chemin.name + f".{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    # Écriture atomique : un lecteur ne voit jamais un fichier partiel
+    os.replace(tmp, chemin)
+
+
+def ouverture_arrow(chemin):
+    # Pas de `with` : le mapping doit rester valide tant que les buffers sont utilisés
+    source = pa.memory_map(str(chemin), "r")
+    return pa.ipc.open_file(source).read_all()
+
+
+def vue_pandas(table):
+    # split_blocks évite la consolidation : les colonnes numériques sans masque
+    # de nullité restent des vues (en lecture seule) sur le fichier mappé. Les
+    # flottants n'en ont pas (NaN, voir ecriture_arrow) ; une colonne entière
+    # avec des valeurs nulles serait en revanche convertie en copie privée.
+    types = {pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}
+    return table.to_pandas(split_blocks=True, self_destruct=False, types_mapper=types.get)
+
+
+def version_preprocessing():
+    # Empreinte du code et des constantes qui produisent les fichiers publiés :
+    # une modification du prétraitement invalide le cache (et tout ce qui en
+    # dérive : matrices .npy, masque de test, artefacts de modèles)
+    contenu = json.dumps({"sources": [inspect.getsource(f) for f in (preprocessing, colonnes_carburant, ecriture_arrow)],
+                          "liste_cbr": LISTE_CBR, "colonnes": COLONNES, "features_dt": FEATURES_DT,
+                          "features_num": FEATURES_NUM}, sort_keys=True)
+    return hashlib.sha1(contenu.encode()).hexdigest()[:8]
+
+
+def publication_dataset(file=FICHIER_CSV, dossier=DOSSIER_CACHE):
+    dossier = Path(dossier)
+    empreinte = f"{empreinte_fichier(file)}_{version_preprocessing()}"
+    chemin_brut = dossier / f"brut_{empreinte}.arrow"
+    chemin_features = dossier / f"features_{empreinte}.arrow"
+
+    if not (chemin_brut.exists() and chemin_features.exists()):
+        dossier.mkdir(parents=True, exist_ok=True)
+        df_original = pd.read_csv(file, on_bad_lines="skip", sep= ',', low_memory=False)
+        # Les colonnes de types mixtes ne sont pas représentables telles quelles en Arrow
+        for col in df_original.select_dtypes(include="object").columns:
+            df_original[col] = df_original[col].astype("string")
+        ecriture_arrow(df_original, chemin_brut)
+        ecriture_arrow(preprocessing(df_original), chemin_features)
+
+    return chemin_brut, chemin_features
+
+
+def chargement_brut(chemin_brut):
+    return vue_pandas(ouverture_arrow(chemin_brut))
+
+
+def chargement_features(chemin_features):
+    table = ouverture_arrow(chemin_features)
+    carburants = colonnes_carburant(table.column_names)
+
+    # Chaque sélection est faite côté Arrow pour ne pas copier les colonnes
+    X_dt = vue_pandas(table.select(FEATURES_DT))
+    X_dl = vue_pandas(table.select(FEATURES_NUM + carburants))
+    X_ts = vue_pandas(table.select(["Consommation mixte (l/100km)"] + carburants))
+    y = vue_pandas(table.select([CIBLE]))[CIBLE]
+
+    return X_dt, y, X_dl, y, X_ts, y
+
+
+def publication_matrice(chemin_features, colonnes=FEATURES_DT):
+    # Matrice dense (n, k) au format .npy pour un mapping mémoire direct par
+    # les processus d'entraînement (np.load(..., mmap_mode="r"))
+    chemin_features = Path(chemin_features)
+    suffixe = hashlib.sha1("|".join(colonnes).encode()).hexdigest()[:8]
+    chemin_X = chemin_features.with_name(f"{chemin_features.stem}_X_{suffixe}.npy")
+    chemin_y = chemin_features.with_name(f"{chemin_features.stem}_y.npy")
+
+    if not (chemin_X.exists() and chemin_y.exists()):
+        table = ouverture_arrow(chemin_features)
+        X = np.column_stack([table.column(c).to_numpy() for c in colonnes]).astype("float64")
+        y = table.column(CIBLE).to_numpy().astype("float64")
+        for chemin, tableau in ((chemin_X, X), (chemin_y, y)):
+            tmp = chemin.with_name(chemin.name + f".{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(tableau))
+            os.replace(tmp, chemin)
+
+    return chemin_X, chemin_y
+
+
+def masque_test(chemin_features, test_size=0.2, random_state=9001):
+    # Découpage train/test publié une seule fois par empreinte du jeu de données :
+    # un masque booléen (True = ligne de test) mappé en mémoire, partagé par tous
+    # les modèles et évaluateurs. Les lignes de test sont celles que donnait
+    # train_test_split(..., random_state=9001), les modèles existants restent
+    # donc évalués sur des lignes qu'ils n'ont pas vues.
+    chemin_features = Path(chemin_features)
+    chemin = chemin_features.with_name(f"{chemin_features.stem}_test_{test_size}_{random_state}.npy")
+
+    if not chemin.exists():
+        n = ouverture_arrow(chemin_features).num_rows
+        _, index_test = train_test_split(np.arange(n), test_size=test_size, random_state=random_state)
+        masque = np.zeros(n, dtype=bool)
+        masque[index_test] = True
+        tmp = chemin.with_name(chemin.name + f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, masque)
+        os.replace(tmp, chemin)
+
+    return np.load(chemin, mmap_mode="r")
+
+
+
+##########################
+# Déduplication pondérée #
+##########################
+
+# Beaucoup de finitions partagent la même homologation : leurs lignes sont
+# identiques sur les variables explicatives et la cible. On les fusionne en une
+# ligne unique pondérée par le nombre d'occurrences ; un modèle entraîné avec
+# ces poids (sample_weight) optimise exactement la même perte.
+
+def deduplication(X, y, poids=None, tolerance=None, tolerance_cible=None, random_state=9001):
+    X = np.asarray(X, dtype="float64")
+    y = np.asarray(y, dtype="float64").ravel()
+    poids = np.ones(len(y)) if poids is None else np.asarray(poids, dtype="float64")
+
+    # Avec une tolérance, les lignes proches (même case de la grille) sont regroupées
+    cle_X = X if tolerance is None else np.round(X / tolerance)
+    cle_y = y if tolerance_cible is None else np.round(y / tolerance_cible)
+    _, premier, inverse = np.unique(np.column_stack([cle_X, cle_y]), axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+
+    poids_u = np.bincount(inverse, weights=poids)
+    if tolerance is None and tolerance_cible is None:
+        X_u, y_u = X[premier], y[premier]
+    else:
+        # Représentant du groupe : moyenne pondérée des lignes fusionnées
+        X_u = np.column_stack([np.bincount(inverse, weights=poids * X[:, j]) for j in range(X.shape[1])]) / poids_u[:, None]
+        y_u = np.bincount(inverse, weights=poids * y) / poids_u
+
+    # np.unique trie les lignes : on les remet dans un ordre aléatoire (graine
+    # fixe) pour que validation_split (les dernières lignes) et les batchs ne
+    # portent pas sur les seules consommations les plus élevées
+    ordre = np.random.default_rng(random_state).permutation(len(y_u))
+    X_u, y_u, poids_u = X_u[ordre], y_u[ordre], poids_u[ordre]
+
+    taux_reduction = 1 - len(y_u) / len(y)
+    return X_u, y_u, poids_u, taux_reduction
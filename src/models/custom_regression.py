@@ -0,0 +1,97 @@
+import numpy as np
+import tensorflow as tf
+
+############################
+# Modèle custom TensorFlow #
+############################
+
+# Cinq régressions linéaires sur la consommation mixte, une par type de carburant.
+# La classe est importée par l'application Streamlit : les modèles sérialisés
+# avec joblib doivent pouvoir la retrouver au chargement.
+
+class CustomRegression():
+    def __init__(self):
+
+        self.w_c1 = tf.Variable(tf.random.normal([1]), name='weight_carb_1')
+        self.w_c2 = tf.Variable(tf.random.normal([1]), name='weight_carb_2')
+        self.w_c3 = tf.Variable(tf.random.normal([1]), name='weight_carb_3')
+        self.w_c4 = tf.Variable(tf.random.normal([1]), name='weight_carb_4')
+        self.w_c5 = tf.Variable(tf.random.normal([1]), name='weight_carb_5')
+
+        self.b_c1 = tf.Variable(tf.random.normal([1]), name='bias_carb_1')
+        self.b_c2 = tf.Variable(tf.random.normal([1]), name='bias_carb_2')
+        self.b_c3 = tf.Variable(tf.random.normal([1]), name='bias_carb_3')
+        self.b_c4 = tf.Variable(tf.random.normal([1]), name='bias_carb_4')
+        self.b_c5 = tf.Variable(tf.random.normal([1]), name='bias_carb_5')
+
+    def __call__(self, conso, carb1, carb2, carb3, carb4, carb5):
+
+        conso = tf.convert_to_tensor(conso, dtype=tf.float32)
+
+        carb1 = tf.convert_to_tensor(carb1, dtype=tf.float32)
+        carb2 = tf.convert_to_tensor(carb2, dtype=tf.float32)
+        carb3 = tf.convert_to_tensor(carb3, dtype=tf.float32)
+        carb4 = tf.convert_to_tensor(carb4, dtype=tf.float32)
+        carb5 = tf.convert_to_tensor(carb5, dtype=tf.float32)
+
+        return carb1 * (conso * self.w_c1 + self.b_c1) + carb2 * (conso * self.w_c2 + self.b_c2) + carb3 * (conso * self.w_c3 + self.b_c3) + carb4 * (conso * self.w_c4 + self.b_c4) + carb5 * (conso * self.w_c5 + self.b_c5)
+
+
+#############################
+# Entraînement par gradient #
+#############################
+
+def entrainement_custom(model, X_ts, y, poids=None, epochs=2000, learning_rate=0.1, tolerance=1e-6, patience=50):
+    # X_ts : consommation mixte puis les 5 indicatrices de carburant.
+    # Les poids (lignes dédupliquées) entrent dans une MSE pondérée, équivalente
+    # à la MSE sur le jeu complet.
+    X_ts = np.asarray(X_ts, dtype="float64")
+    y = np.asarray(y, dtype="float64").ravel()
+    poids = np.ones(len(y)) if poids is None else np.asarray(poids, dtype="float64")
+    poids = poids / poids.sum()
+
+    # Consommation et cible centrées réduites : Adam avance d'environ
+    # `learning_rate` par pas, les paramètres doivent donc rester d'ordre 1
+    # (sur les données brutes, les ordonnées à l'origine ~100 g/km ne sont pas
+    # atteintes en 2000 pas). Chaque ligne a exactement une indicatrice à 1 :
+    # on revient aux unités d'origine carburant par carburant après l'entraînement.
+    moy_c, ec_c = np.average(X_ts[:, 0], weights=poids), np.sqrt(np.cov(X_ts[:, 0], aweights=poids, bias=True))
+    moy_y, ec_y = np.average(y, weights=poids), np.sqrt(np.cov(y, aweights=poids, bias=True))
+    X_z = X_ts.copy()
+    X_z[:, 0] = (X_z[:, 0] - moy_c) / ec_c
+
+    X_z = tf.convert_to_tensor(X_z, dtype=tf.float32)
+    y_z = tf.convert_to_tensor((y - moy_y) / ec_y, dtype=tf.float32)
+    poids = tf.convert_to_tensor(poids, dtype=tf.float32)
+
+    poids_modele = [model.w_c1, model.w_c2, model.w_c3, model.w_c4, model.w_c5]
+    biais_modele = [model.b_c1, model.b_c2, model.b_c3, model.b_c4, model.b_c5]
+    variables = poids_modele + biais_modele
+    optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+
+    @tf.function
+    def etape():
+        with tf.GradientTape() as tape:
+            y_pred = model(X_z[:, 0], X_z[:, 1], X_z[:, 2], X_z[:, 3], X_z[:, 4], X_z[:, 5])
+            loss = tf.reduce_sum(poids * tf.square(y_z - y_pred))
+        optimizer.apply_gradients(zip(tape.gradient(loss, variables), variables))
+        return loss
+
+    # Arrêt lorsque la perte ne baisse plus (relativement) de `tolerance`
+    # pendant `patience` itérations ; `epochs` reste un plafond
+    losses, meilleure, attente = [], np.inf, 0
+    for _ in range(epochs):
+        losses.append(float(etape()) * ec_y ** 2)
+        if losses[-1] < meilleure * (1 - tolerance):
+            meilleure, attente = losses[-1], 0
+        else:
+            attente += 1
+            if attente >= patience:
+                break
+
+    for w, b in zip(poids_modele, biais_modele):
+        w_z, b_z = w.numpy(), b.numpy()
+        w.assign(ec_y * w_z / ec_c)
+        b.assign(ec_y * (b_z - w_z * moy_c / ec_c) + moy_y)
+
+    return losses
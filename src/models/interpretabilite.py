@@ -0,0 +1,104 @@
+import hashlib
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+##############################
+# Importance par permutation #
+##############################
+
+# `predict` est une fonction qui prend une matrice (n, k) et renvoie n prédictions.
+# Les permutations de plusieurs répétitions sont empilées dans un même lot afin
+# d'appeler le modèle une seule fois par lot (et non une fois par répétition).
+# Les lots sont répartis sur un pool de threads : les prédictions scikit-learn
+# et TensorFlow libèrent le GIL, et les modèles n'ont pas à être sérialisés.
+
+def sous_echantillon(X, y, n_echantillon=None, random_state=9001):
+    if n_echantillon is None or n_echantillon >= len(X):
+        return X, y
+    index = np.random.default_rng(random_state).choice(len(X), n_echantillon, replace=False)
+    return X[index], y[index]
+
+
+def prediction_lot(predict, lot):
+    # lot : (r, n, k) -> prédictions (r, n) en un seul appel au modèle
+    r, n, k = lot.shape
+    return np.asarray(predict(lot.reshape(r * n, k)), dtype="float64").reshape(r, n)
+
+
+def decoupage_repetitions(n_repetitions, n, taille_lot):
+    # Nombre de répétitions par lot pour ne pas dépasser `taille_lot` lignes
+    par_lot = max(1, taille_lot // n)
+    return [min(par_lot, n_repetitions - i) for i in range(0, n_repetitions, par_lot)]
+
+
+def erreurs_permutation(predict, X, y, colonnes, n_repetitions, graine):
+    rng = np.random.default_rng(graine)
+    permutations = np.argsort(rng.random((n_repetitions, len(X))), axis=1)
+
+    lot = np.broadcast_to(X, (n_repetitions,) + X.shape).copy()
+    # Les colonnes d'un même groupe (ex. indicatrices du carburant) sont permutées ensemble
+    lot[:, :, colonnes] = X[:, colonnes][permutations]
+
+    y_pred = prediction_lot(predict, lot)
+    return np.abs(y_pred - y).mean(axis=1)
+
+
+def importance_permutation(predict, X, y, groupes, n_repetitions=10, n_echantillon=None,
+                           taille_lot=200_000, n_jobs=None, random_state=9001):
+    X = np.asarray(X, dtype="float64")
+    y = np.asarray(y, dtype="float64").ravel()
+    X, y = sous_echantillon(X, y, n_echantillon, random_state)
+
+    mae_base = np.abs(np.asarray(predict(X), dtype="float64").ravel() - y).mean()
+
+    taches = [(nom, np.atleast_1d(colonnes), taille, [random_state, i, j])
+              for i, (nom, colonnes) in enumerate(groupes.items())
+              for j, taille in enumerate(decoupage_repetitions(n_repetitions, len(X), taille_lot))]
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        resultats = pool.map(lambda t: (t[0], erreurs_permutation(predict, X, y, t[1], t[2], t[3])), taches)
+        erreurs = {}
+        for nom, mae in resultats:
+            erreurs.setdefault(nom, []).append(mae)
+
+    lignes = []
+    for nom, mae in erreurs.items():
+        delta = np.concatenate(mae) - mae_base
+        demi_ic = 1.96 * delta.std(ddof=1) / np.sqrt(len(delta)) if len(delta) > 1 else np.nan
+        lignes.append({"variable": nom, "importance": delta.mean(), "ecart_type": delta.std(ddof=1) if len(delta) > 1 else np.nan,
+                       "ic_bas": delta.mean() - demi_ic, "ic_haut": delta.mean() + demi_ic})
+
+    importances = pd.DataFrame(lignes).set_index("variable").sort_values("importance", ascending=False)
+    return importances, mae_base
+
+
+########################
+# Dépendance partielle #
+########################
+
+def dependance_partielle(predict, X, colonne, grille, n_echantillon=None, taille_lot=200_000, random_state=9001):
+    X = np.asarray(X, dtype="float64")
+    X, _ = sous_echantillon(X, np.empty(len(X)), n_echantillon, random_state)
+    grille = np.asarray(grille, dtype="float64")
+
+    moyennes = []
+    debut = 0
+    for taille in decoupage_repetitions(len(grille), len(X), taille_lot):
+        # Une copie de l'échantillon par point de grille, évaluées en un seul lot
+        lot = np.broadcast_to(X, (taille,) + X.shape).copy()
+        lot[:, :, colonne] = grille[debut:debut + taille, None]
+        moyennes.append(prediction_lot(predict, lot).mean(axis=1))
+        debut += taille
+
+    return np.concatenate(moyennes)
+
+
+def version_interpretabilite():
+    # Empreinte du code des calculs : une modification invalide les résultats
+    # mis en cache sur disque par l'application
+    contenu = "".join(inspect.getsource(f) for f in (sous_echantillon, prediction_lot, decoupage_repetitions,
+                                                      erreurs_permutation, importance_permutation, dependance_partielle))
+    return hashlib.sha1(contenu.encode()).hexdigest()[:8]
@@ -0,0 +1,407 @@
+import argparse
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import LinearRegression, Ridge
+from sklearn.metrics import mean_absolute_error, mean_squared_error
+from sklearn.model_selection import KFold
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import DecisionTreeRegressor
+from joblib import dump
+from threadpoolctl import threadpool_limits
+
+from src.features.build_features import (FEATURES_DT, FICHIER_CSV, DOSSIER_CACHE, publication_dataset, publication_matrice,
+                                         chargement_features, masque_test, deduplication, preprocessing)
+
+#####################
+# Modèles candidats #
+#####################
+
+# Chaque candidat est normalisé dans son pipeline : le scaler est ajusté sur
+# les plis d'entraînement uniquement
+CANDIDATS = {
+    "DecisionTree": DecisionTreeRegressor(max_depth=None),
+    "LinearRegression": LinearRegression(),
+    "Ridge": Ridge(alpha=1.0),
+    "KNeighbors": KNeighborsRegressor(n_neighbors=5),
+    "RandomForest": RandomForestRegressor(n_estimators=100, n_jobs=1, random_state=9001),
+    "HistGradientBoosting": HistGradientBoostingRegressor(random_state=9001),
+}
+
+DOSSIER_RAPPORTS = Path(__file__).resolve().parents[2] / "reports"
+DOSSIER_MODELES = Path(__file__).resolve().parents[2] / "models"
+
+
+################################
+# Évaluation d'un pli (worker) #
+################################
+
+def evaluation_pli(nom, estimateur, chemin_X, chemin_y, index_train, index_test, repetitions_latence=20):
+    # Les matrices sont mappées en lecture seule : aucun transfert de données
+    # entre le processus principal et les workers, seulement les index
+    X = np.load(chemin_X, mmap_mode="r")
+    y = np.load(chemin_y, mmap_mode="r")
+
+    # Un thread par worker : le parallélisme est porté par le pool de processus
+    with threadpool_limits(limits=1):
+        modele = make_pipeline(StandardScaler(), clone(estimateur))
+
+        debut = time.perf_counter()
+        modele.fit(X[index_train], y[index_train])
+        temps_fit = time.perf_counter() - debut
+
+        X_test = X[index_test]
+        debut = time.perf_counter()
+        y_pred = modele.predict(X_test)
+        temps_predict = time.perf_counter() - debut
+
+        # Latence d'un appel unitaire, comme dans la page "Votre prédiction"
+        ligne = X_test[:1]
+        durees = []
+        for _ in range(repetitions_latence):
+            debut = time.perf_counter()
+            modele.predict(ligne)
+            durees.append(time.perf_counter() - debut)
+
+    return {
+        "modele": nom,
+        "mae": mean_absolute_error(y[index_test], y_pred),
+        "rmse": np.sqrt(mean_squared_error(y[index_test], y_pred)),
+        "temps_fit_s": temps_fit,
+        "latence_ligne_us": temps_predict / len(index_test) * 1e6,
+        "latence_unitaire_ms": np.median(durees) * 1e3,
+        "taille_ko": len(pickle.dumps(modele, protocol=pickle.HIGHEST_PROTOCOL)) / 1024,
+    }
+
+
+####################################
+# Validation croisée et classement #
+####################################
+
+def validation_croisee(chemin_X, chemin_y, candidats=CANDIDATS, n_splits=5, n_workers=None, random_state=9001,
+                       index=None):
+    # `index` : lignes sur lesquelles portent les plis (par défaut toutes). Les
+    # lignes du masque de test commun en sont exclues pour que le leaderboard
+    # ne voie pas les lignes sur lesquelles les modèles servis sont évalués
+    if index is None:
+        index = np.arange(np.load(chemin_y, mmap_mode="r").shape[0])
+    plis = [(index[train], index[test])
+            for train, test in KFold(n_splits=n_splits, shuffle=True, random_state=random_state).split(index)]
+
+    # Une tâche par couple (modèle, pli) pour équilibrer la charge entre workers
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        taches = [pool.submit(evaluation_pli, nom, estimateur, str(chemin_X), str(chemin_y), index_train, index_test)
+                  for nom, estimateur in candidats.items()
+                  for index_train, index_test in plis]
+        resultats = pd.DataFrame([t.result() for t in taches])
+
+    leaderboard = resultats.groupby("modele").agg(
+        mae=("mae", "mean"),
+        mae_std=("mae", "std"),
+        rmse=("rmse", "mean"),
+        temps_fit_s=("temps_fit_s", "mean"),
+        latence_ligne_us=("latence_ligne_us", "median"),
+        latence_unitaire_ms=("latence_unitaire_ms", "median"),
+        taille_ko=("taille_ko", "mean"),
+    )
+    return leaderboard.sort_values("mae")
+
+
+def selection_modele(leaderboard, tolerance=0.05):
+    # On retient le modèle le moins coûteux à servir parmi ceux dont la MAE
+    # reste à moins de `tolerance` (relative) de la meilleure MAE
+    seuil = leaderboard["mae"].min() * (1 + tolerance)
+    eligibles = leaderboard[leaderboard["mae"] <= seuil]
+    retenu = eligibles.sort_values(["latence_unitaire_ms", "taille_ko", "mae"]).index[0]
+
+    leaderboard = leaderboard.copy()
+    leaderboard["eligible"] = leaderboard["mae"] <= seuil
+    leaderboard["retenu"] = leaderboard.index == retenu
+    return retenu, leaderboard
+
+
+##########################################
+# Entraînement des modèles de production #
+##########################################
+
+# Les trois modèles servis par l'application Streamlit. Chaque fonction reçoit
+# le jeu d'entraînement dédupliqué et ses poids ; les imports TensorFlow sont
+# faits dans le worker pour que le processus de l'arbre de décision ne le charge pas.
+
+def entrainement_decision_tree(X, y, poids, max_depth=None):
+    return DecisionTreeRegressor(max_depth=max_depth).fit(X, y, sample_weight=poids)
+
+
+def entrainement_dl2(X, y, poids, epochs=100, batch_size=32):
+    from keras import layers, models, optimizers
+
+    inputs = layers.Input((X.shape[1], ), name="inputs")
+    dense1 = layers.Dense(16, activation="relu", name="dense1")
+    dense4 = layers.Dense(1, name="output")
+    model_dl = models.Model(inputs = inputs, outputs = dense4(dense1(inputs)))
+    model_dl.compile(loss="mean_squared_error", optimizer=optimizers.Adam())
+
+    # Validation sur 10 % des lignes tirées au hasard : validation_split prendrait
+    # les dernières lignes, qui ne sont pas un échantillon représentatif si
+    # l'entrée est ordonnée. Poids ramenés à une moyenne de 1 pour garder
+    # l'échelle des gradients par batch
+    ordre = np.random.default_rng(9001).permutation(len(y))
+    val, train = ordre[:len(y) // 10], ordre[len(y) // 10:]
+    model_dl.fit(X[train], y[train], sample_weight=poids[train] / poids[train].mean(),
+                 validation_data=(X[val], y[val], poids[val] / poids[val].mean()),
+                 epochs=epochs, batch_size=batch_size, verbose=0)
+    return model_dl
+
+
+def entrainement_tf_france(X, y, poids, epochs=2000, learning_rate=0.1):
+    from src.models.custom_regression import CustomRegression, entrainement_custom
+
+    model_tf = CustomRegression()
+    entrainement_custom(model_tf, X, y, poids, epochs=epochs, learning_rate=learning_rate)
+    return model_tf
+
+
+# Nom de l'artefact (celui chargé par l'application) -> (features, entraînement, hyperparamètres)
+MODELES = {
+    "decision_tree": ("dt", entrainement_decision_tree, {"max_depth": None}),
+    "model_dl2": ("dl", entrainement_dl2, {"epochs": 100, "batch_size": 32}),
+    "model_tf_france": ("ts", entrainement_tf_france, {"epochs": 2000, "learning_rate": 0.1}),
+}
+
+
+def donnees_modele(features, chemin_features):
+    # Mêmes matrices que l'application : X_dt et X_dl normalisés sur tout le
+    # jeu, X_ts (consommation et indicatrices) brut
+    X_dt, y, X_dl, _, X_ts, _ = chargement_features(chemin_features)
+    if features == "dt":
+        X = StandardScaler().fit_transform(X_dt)
+    elif features == "dl":
+        X = StandardScaler().fit_transform(X_dl)
+    else:
+        X = X_ts.to_numpy(dtype="float64")
+    return X, y.to_numpy(dtype="float64")
+
+
+def prediction_modele(modele, X):
+    if isinstance(modele, DecisionTreeRegressor):
+        return modele.predict(X)
+    if hasattr(modele, "predict"):
+        return np.asarray(modele.predict(X, verbose=0)).ravel()
+    # Modèle custom : une colonne par argument (consommation puis indicatrices)
+    return np.asarray(modele(*(X[:, i] for i in range(X.shape[1])))).ravel()
+
+
+def cle_entrees(nom, chemin_features, parametres):
+    # Empreinte de tout ce qui détermine l'artefact : jeu de données (déjà
+    # identifié par son empreinte et la version du prétraitement), découpage,
+    # hyperparamètres et tout le code traversé par l'entraînement. Le module du
+    # modèle custom est lu comme texte pour ne pas importer TensorFlow ici.
+    features, entrainement, _ = MODELES[nom]
+    code = [inspect.getsource(f) for f in (entrainement, donnees_modele, prediction_modele,
+                                           deduplication, masque_test, preprocessing)]
+    code.append(Path(__file__).with_name("custom_regression.py").read_text(encoding="utf-8"))
+    contenu = json.dumps({"features": Path(chemin_features).stem, "type_features": features,
+                          "test_size": 0.2, "random_state": 9001, "parametres": parametres,
+                          "code": code}, sort_keys=True, default=str)
+    return hashlib.sha1(contenu.encode()).hexdigest()[:12]
+
+
+def ecriture_atomique(ecriture, chemin):
+    # Écriture dans un fichier temporaire du même dossier puis renommage :
+    # l'application ne lit jamais un artefact partiel
+    tmp = chemin.with_name(chemin.name + f".{os.getpid()}.tmp")
+    ecriture(tmp)
+    os.replace(tmp, chemin)
+
+
+def limitation_threads(n_threads):
+    # Initialisation de chaque worker, avant tout import de TensorFlow :
+    # n_threads par processus pour que les modèles entraînés en parallèle
+    # ne se disputent pas les cœurs
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                     "TF_NUM_INTRAOP_THREADS"]:
+        os.environ[variable] = str(n_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+
+def promotion_autorisee(chemin_manifeste, manifeste):
+    # La version en place n'est remplacée que si la nouvelle fait au moins aussi
+    # bien sur le même jeu de test (mêmes features, donc même masque)
+    if not chemin_manifeste.exists():
+        return True
+    actuel = json.loads(chemin_manifeste.read_text())
+    if actuel.get("features") != manifeste["features"]:
+        return True
+    return manifeste["mae_test"] <= actuel["mae_test"]
+
+
+def entrainement_modele(nom, chemin_features, dossier, parametres, cle, n_threads, promouvoir=False):
+    debut = time.perf_counter()
+    features, entrainement, _ = MODELES[nom]
+
+    with threadpool_limits(limits=n_threads):
+        X, y = donnees_modele(features, chemin_features)
+        test = masque_test(chemin_features, test_size=0.2, random_state=9001)
+
+        # Déduplication pondérée du jeu d'entraînement (le jeu de test reste inchangé)
+        X_train, y_train, poids, taux_reduction = deduplication(X[~test], y[~test])
+        modele = entrainement(X_train, y_train, poids, **parametres)
+        mae = float(np.abs(prediction_modele(modele, X[test]) - y[test]).mean())
+
+    # Artefact et manifeste versionnés, toujours conservés : un fichier par
+    # exécution, pour que `--forcer` n'écrase jamais la version promue
+    dossier = Path(dossier)
+    execution = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+    chemin_version = dossier / f"{nom}-{cle}-{execution}"
+    ecriture_atomique(lambda tmp: dump(modele, tmp), chemin_version)
+
+    manifeste = {"modele": nom, "version": cle, "execution": execution, "artefact": chemin_version.name,
+                 "features": Path(chemin_features).name, "parametres": parametres,
+                 "mae_test": mae, "lignes_entrainement": len(y_train), "taux_reduction": taux_reduction,
+                 "threads": n_threads, "duree_s": time.perf_counter() - debut,
+                 "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+    chemin_manifeste = dossier / f"{nom}.json"
+    manifeste["promu"] = promouvoir or promotion_autorisee(chemin_manifeste, manifeste)
+
+    manifestes = [chemin_version.with_name(chemin_version.name + ".json")]
+    if manifeste["promu"]:
+        # Bascule atomique du nom stable lu par l'application
+        ecriture_atomique(lambda tmp: shutil.copyfile(chemin_version, tmp), dossier / nom)
+        manifestes.append(chemin_manifeste)
+    for chemin in manifestes:
+        ecriture_atomique(lambda tmp: Path(tmp).write_text(json.dumps(manifeste, indent=2)), chemin)
+    return manifeste
+
+
+def a_jour(nom, dossier, cle):
+    # Le modèle est ignoré si cette version a déjà été entraînée (promue ou
+    # non, par au moins une exécution) et qu'un artefact est en place sous le
+    # nom stable
+    dossier = Path(dossier)
+    executions = [chemin for chemin in dossier.glob(f"{nom}-{cle}-*.json")
+                  if chemin.with_suffix("").exists()]
+    return bool(executions) and (dossier / nom).exists()
+
+
+def orchestration(chemin_features, noms=tuple(MODELES), dossier=DOSSIER_MODELES, parametres=None,
+                  n_threads=None, forcer=False, promouvoir=False):
+    dossier = Path(dossier)
+    dossier.mkdir(parents=True, exist_ok=True)
+    parametres = {nom: {**MODELES[nom][2], **(parametres or {}).get(nom, {})} for nom in noms}
+
+    # Le masque de test est créé ici, une seule fois, avant le lancement des workers
+    masque_test(chemin_features, test_size=0.2, random_state=9001)
+
+    cles = {nom: cle_entrees(nom, chemin_features, parametres[nom]) for nom in noms}
+    a_entrainer = [nom for nom in noms if forcer or not a_jour(nom, dossier, cles[nom])]
+    ignores = [nom for nom in noms if nom not in a_entrainer]
+    if not a_entrainer:
+        return {}, ignores
+
+    # Un processus par modèle : la durée totale est celle du modèle le plus long.
+    # "spawn" plutôt que fork : TensorFlow ne supporte pas d'être hérité d'un parent
+    n_threads = n_threads or max(1, (os.cpu_count() or 1) // len(a_entrainer))
+    contexte = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(a_entrainer), mp_context=contexte,
+                             initializer=limitation_threads, initargs=(n_threads,)) as pool:
+        taches = {pool.submit(entrainement_modele, nom, str(chemin_features), str(dossier),
+                              parametres[nom], cles[nom], n_threads, promouvoir): nom
+                  for nom in a_entrainer}
+        resultats = {}
+        for tache in as_completed(taches):
+            nom = taches[tache]
+            resultats[nom] = tache.result()
+            print(f"{nom} : MAE test {resultats[nom]['mae_test']:.3f}, {resultats[nom]['duree_s']:.1f} s"
+                  + ("" if resultats[nom]["promu"] else " - moins bon que la version en place, non promu"))
+
+    return resultats, ignores
+
+
+def commande_leaderboard(args):
+    # Features construites une seule fois, puis partagées par mapping mémoire
+    _, chemin_features = publication_dataset(args.csv, args.cache)
+    chemin_X, chemin_y = publication_matrice(chemin_features, FEATURES_DT)
+
+    # Plis construits sur les seules lignes d'entraînement du découpage commun
+    index_train = np.flatnonzero(~masque_test(chemin_features, test_size=0.2, random_state=9001))
+
+    candidats = {nom: CANDIDATS[nom] for nom in args.modeles}
+    leaderboard = validation_croisee(chemin_X, chemin_y, candidats, n_splits=args.folds, n_workers=args.workers,
+                                     index=index_train)
+    retenu, leaderboard = selection_modele(leaderboard, args.tolerance)
+
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.float_format", "{:.3f}".format):
+        print(leaderboard)
+    print(f"\nModèle retenu : {retenu}")
+
+    sortie = Path(args.sortie) if args.sortie else DOSSIER_RAPPORTS / f"leaderboard_{Path(chemin_features).stem}.csv"
+    leaderboard.to_csv(sortie)
+    print(f"Leaderboard écrit dans {sortie}")
+
+
+def commande_entrainement(args):
+    # Prétraitement unique dans le cache partagé, lu ensuite par chaque worker
+    _, chemin_features = publication_dataset(args.csv, args.cache)
+
+    parametres = {}
+    if args.epochs_dl is not None:
+        parametres["model_dl2"] = {"epochs": args.epochs_dl}
+    if args.epochs_tf is not None:
+        parametres["model_tf_france"] = {"epochs": args.epochs_tf}
+
+    debut = time.perf_counter()
+    resultats, ignores = orchestration(chemin_features, args.modeles, args.sortie, parametres,
+                                       n_threads=args.threads, forcer=args.forcer, promouvoir=args.promouvoir)
+    for nom in ignores:
+        print(f"{nom} : entrées inchangées, artefact conservé")
+    print(f"{len(resultats)} modèle(s) entraîné(s) en {time.perf_counter() - debut:.1f} s dans {args.sortie}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entraînement et comparaison des modèles de prédiction du CO2")
+    parser.add_argument("--csv", default=FICHIER_CSV)
+    parser.add_argument("--cache", default=DOSSIER_CACHE)
+    commandes = parser.add_subparsers(dest="commande", required=True)
+
+    leaderboard = commandes.add_parser("leaderboard", help="Validation croisée des modèles candidats et leaderboard")
+    leaderboard.add_argument("--modeles", nargs="+", default=list(CANDIDATS), choices=list(CANDIDATS))
+    leaderboard.add_argument("--folds", type=int, default=5)
+    leaderboard.add_argument("--workers", type=int, default=None)
+    leaderboard.add_argument("--tolerance", type=float, default=0.05,
+                             help="Écart relatif de MAE toléré pour privilégier un modèle moins coûteux à servir")
+    leaderboard.add_argument("--sortie", default=None, help="Fichier CSV du leaderboard")
+    leaderboard.set_defaults(fonction=commande_leaderboard)
+
+    entrainement = commandes.add_parser("entrainement", help="Entraînement parallèle des modèles servis par l'application")
+    entrainement.add_argument("--modeles", nargs="+", default=list(MODELES), choices=list(MODELES))
+    entrainement.add_argument("--threads", type=int, default=None,
+                              help="Threads par worker (par défaut : cœurs disponibles / nombre de modèles)")
+    entrainement.add_argument("--epochs-dl", type=int, default=None)
+    entrainement.add_argument("--epochs-tf", type=int, default=None)
+    entrainement.add_argument("--forcer", action="store_true", help="Réentraîne même si les entrées sont inchangées")
+    entrainement.add_argument("--promouvoir", action="store_true",
+                              help="Remplace la version en place même si sa MAE de test est meilleure")
+    entrainement.add_argument("--sortie", default=DOSSIER_MODELES, help="Dossier des artefacts")
+    entrainement.set_defaults(fonction=commande_entrainement)
+
+    args = parser.parse_args()
+    args.fonction(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,47 +7,32 @@ from sklearn.metrics import mean_squared_error, mean_absolute_error
 from sklearn.tree import DecisionTreeRegressor
 from joblib import dump
 
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from src.features.build_features import publication_dataset, chargement_features, masque_test, deduplication
+
 
 file = 'data_2012-2015.csv'
-df = pd.read_csv(file, on_bad_lines="skip", sep= ',', low_memory=False)
 
 ### PREPROCESSING ###
+# Jeu de données publié une seule fois (Arrow) et partagé avec l'application
 
 scaler = StandardScaler()
-encoder_le =  LabelEncoder()
 
-file = 'data_2012-2015.csv'
-df_original = pd.read_csv(file, on_bad_lines="skip", sep= ',', low_memory=False)
-
-liste_cbr = {"GO":"Gazole",
-            "ES":"Essence",
-            "EH":"Essence",
-            "GH":"Gazole",
-            "ES/GN":"Essence",
-            "GN/ES":"Gaz Naturel Vehicule (GNV)",
-            "ES/GP":"Essence",
-            "GP/ES":"Gaz de Petrole Liquefie (GPL)",
-            "EL":"Electrique",
-            "GN":"Gaz Naturel Vehicule (GNV)",
-            "EE":"Essence",
-            "FE":"SuperEthanol-E85",
-            "GL":"Gazole"}
-
-df_original["Carburant"] = df_original["Carburant"].replace(liste_cbr)
-
-df = df_original[["Consommation mixte (l/100km)", "Carburant", "CO2 (g/km)", "Puissance administrative","masse vide euro min (kg)"]]
-df = df.dropna(how="any")
-
-df["Carburant"] = encoder_le.fit_transform(df["Carburant"])
-
-X = df.drop(columns="CO2 (g/km)")
+_, chemin_features = publication_dataset(file)
+X, y, _, _, _, _ = chargement_features(chemin_features)
 X = scaler.fit_transform(X)
-y = df["CO2 (g/km)"]
 
-# TRAIN TEST SPLIT - 20% en test split
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=9001)
+# TRAIN TEST SPLIT - 20% en test split, découpage commun à tous les modèles
+test = masque_test(chemin_features, test_size=0.2, random_state=9001)
+X_train, X_test, y_train, y_test = X[~test], X[test], y[~test], y[test]
+
+# Déduplication pondérée du jeu d'entraînement (le jeu de test reste inchangé)
+X_train, y_train, w_train, taux_reduction = deduplication(X_train, y_train)
+print(f"Déduplication : {len(y_train)} lignes uniques, réduction de {taux_reduction:.1%}")
 
 # Modélisation
 model = DecisionTreeRegressor(max_depth = None)
-model.fit(X_train, y_train)
+model.fit(X_train, y_train, sample_weight=w_train)
 dump(model, "decision_tree")
\ No newline at end of file
@@ -2,44 +2,29 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from keras import layers, models, optimizers
 from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.model_selection import train_test_split
 from joblib import dump, load
 
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from src.features.build_features import publication_dataset, chargement_features, masque_test, deduplication
+
 file = 'data_2012-2015.csv'
-df_original = pd.read_csv(file, on_bad_lines="skip", sep= ',', low_memory=False)
 
+# Jeu de données publié une seule fois (Arrow) et partagé avec l'application
 scaler = StandardScaler()
-encoder_le =  LabelEncoder()
-
-liste_cbr = {"GO":"Gazole",
-            "ES":"Essence",
-            "EH":"Essence",
-            "GH":"Gazole",
-            "ES/GN":"Essence",
-            "GN/ES":"Gaz Naturel Vehicule (GNV)",
-            "ES/GP":"Essence",
-            "GP/ES":"Gaz de Petrole Liquefie (GPL)",
-            "EL":"Electrique",
-            "GN":"Gaz Naturel Vehicule (GNV)",
-            "EE":"Essence",
-            "FE":"SuperEthanol-E85",
-            "GL":"Gazole"}
-
-df_original["Carburant"] = df_original["Carburant"].replace(liste_cbr)
-
-df = df_original[["Consommation mixte (l/100km)", "Carburant", "CO2 (g/km)", "Puissance administrative","masse vide euro min (kg)"]]
-df = df.dropna(how="any")
 
-df_carb = pd.get_dummies(df["Carburant"])
-df_carb = df_carb.replace({True:1, False:0})
-
-df["Carburant"] = encoder_le.fit_transform(df["Carburant"])
-
-X_dl = pd.concat([df[["Consommation mixte (l/100km)", "Puissance administrative","masse vide euro min (kg)"]], df_carb], axis=1)
+_, chemin_features = publication_dataset(file)
+_, _, X_dl, y_dl, _, _ = chargement_features(chemin_features)
 X_dl = scaler.fit_transform(X_dl)
-y_dl = df["CO2 (g/km)"]
 
-X_dl_train, X_dl_test, y_dl_train, y_dl_test = train_test_split(X_dl, y_dl, test_size=0.2, random_state=9001)
+# Découpage train/test commun à tous les modèles
+test = masque_test(chemin_features, test_size=0.2, random_state=9001)
+X_dl_train, X_dl_test, y_dl_train, y_dl_test = X_dl[~test], X_dl[test], y_dl[~test], y_dl[test]
+
+# Déduplication pondérée du jeu d'entraînement (le jeu de test reste inchangé)
+X_dl_train, y_dl_train, w_dl_train, taux_reduction = deduplication(X_dl_train, y_dl_train)
+print(f"Déduplication : {len(y_dl_train)} lignes uniques, réduction de {taux_reduction:.1%}")
 
 ### DEUXIÈME MODÈLE DE DEEP LEARNING
 # Les 4 variables explicatives sont utilisées pour prédire CO2
@@ -61,5 +46,6 @@ model_dl = models.Model(inputs = inputs, outputs = outputs)
 model_dl.compile(loss="mean_squared_error", optimizer=optimizer)
 
 # Entraînement
-hist = model_dl.fit(X_dl_train, y_dl_train, epochs=100, batch_size=32, validation_split=0.1)
+# Poids ramenés à une moyenne de 1 pour garder l'échelle des gradients par batch
+hist = model_dl.fit(X_dl_train, y_dl_train, sample_weight=w_dl_train / w_dl_train.mean(), epochs=100, batch_size=32, validation_split=0.1)
 dump(model_dl, "model_dl2")
\ No newline at end of file
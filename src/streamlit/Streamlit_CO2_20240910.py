@@ -1,19 +1,196 @@
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
+import plotly.io as pio
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import tensorflow as tf
 from PIL import Image
 
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 
 from joblib import load
 import streamlit as st
 
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from src.features.build_features import publication_dataset, chargement_brut, chargement_features, masque_test
+# CustomRegression doit être visible dans le script pour le chargement de model_tf_france
+from src.models.custom_regression import CustomRegression
+from src.models.interpretabilite import importance_permutation, dependance_partielle, version_interpretabilite
+from src.visualization.visualize import figures_visualisation, version_visualisation
+from src.streamlit.disponibilite import FICHIER_PRET, debut_processus
+
+###############################################
+# Chargement et préparation du jeu de données #
+###############################################
+
+# Le jeu de données est publié une seule fois en Arrow puis mappé en mémoire :
+# toutes les sessions partagent les mêmes buffers (lecture seule, sans copie)
+@st.cache_resource
+def publication():
+    file = 'data_2012-2015.csv'
+    return publication_dataset(file)
+
+@st.cache_resource
+def chargement_dataset():
+    chemin_brut, chemin_features = publication()
+
+    df_original = chargement_brut(chemin_brut)
+    X_dt, y_dt, X_dl, y_dl, X_ts, y_ts = chargement_features(chemin_features)
+
+    return df_original, X_dt, y_dt, X_dl, y_dl, X_ts, y_ts
+
+# Specs JSON des figures de la Data Viz, mises en cache sur disque par empreinte
+# du jeu de données (le nom du fichier Arrow publié contient cette empreinte) et
+# par version du code des figures
+@st.cache_data(persist="disk", show_spinner=False)
+def specs_visualisation(empreinte, version):
+    df = chargement_dataset()[0]
+    return {nom: fig.to_json() for nom, fig in figures_visualisation(df).items()}
+
+################
+# Modélisation #
+################
+
+def affichage_metrics(residus, y_pred, y_test):
+    st.write("MSQE : {:.2f}".format(mean_squared_error(y_test, y_pred)))
+    st.write("MAE : {:.2f}".format(mean_absolute_error(y_test, y_pred)))
+
+    st.write("\nProportion < 1% d'ecart  : {:.2f}%".format((len(residus[residus<1]) / len(residus)) * 100))
+    st.write("Proportion < 5% d'ecart  : {:.2f}%".format((len(residus[residus<5]) / len(residus)) * 100))
+    st.write("Proportion < 10% d'ecart : {:.2f}%".format((len(residus[residus<10]) / len(residus)) * 100))
+
+def calcul_residus(y_pred, y_test):
+    residus = []
+    for i in range(len(y_test)):
+        residus.append(((y_pred[i] - y_test.values[i]) / y_test.values[i]) * 100)
+
+    return np.absolute(residus)
+
+##########################
+# Chargement des modèles #
+##########################
+
+# Par défaut les artefacts sont lus dans le dossier courant ; CO2_DOSSIER_MODELES
+# permet de pointer vers le dossier alimenté par `train_model entrainement`
+DOSSIER_MODELES = Path(os.environ.get("CO2_DOSSIER_MODELES", "."))
+FICHIERS_MODELES = {'DecisionTree': DOSSIER_MODELES / "decision_tree",
+                    'Réseau de neurones': DOSSIER_MODELES / "model_dl2",
+                    'Modèle custom TensorFlow': DOSSIER_MODELES / "model_tf_france"}
+
+def empreinte_artefact(option):
+    # Taille et date de modification du fichier : change à chaque réentraînement
+    stat = os.stat(FICHIERS_MODELES[option])
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+# Un modèle par artefact sur disque : après un réentraînement, la nouvelle
+# empreinte charge le nouveau modèle au lieu de servir celui déjà en mémoire
+@st.cache_resource(max_entries=len(FICHIERS_MODELES))
+def chargement_modele(option, empreinte):
+    with open(FICHIERS_MODELES[option], "rb") as f:
+        # Empreinte vérifiée sur le fichier ouvert : il a pu être remplacé depuis
+        stat = os.fstat(f.fileno())
+        if f"{stat.st_size}-{stat.st_mtime_ns}" != empreinte:
+            raise RuntimeError(f"Artefact {FICHIERS_MODELES[option]} remplacé pendant le chargement, relancer la page")
+        return load(f)
+
+def chargement_models():
+    # Modèles DecisionTree, réseau de neurones et custom TensorFlow
+    return tuple(chargement_modele(option, empreinte_artefact(option)) for option in FICHIERS_MODELES)
+
+###########################################
+# Préparation des données de modélisation #
+###########################################
+
+@st.cache_resource
+def preparation_modelisation():
+    df_original, X_dt, y_dt, X_dl, y_dl, X_ts, y_ts = chargement_dataset()
+
+    scaler = StandardScaler()
+    X_dt = scaler.fit_transform(X_dt)
+    scaler2 = StandardScaler()
+    X_dl = scaler2.fit_transform(X_dl)
+
+    # Découpage unique partagé par les trois modèles (lié à l'empreinte du jeu de
+    # données) : l'application n'évalue les modèles que sur l'échantillon de test
+    test = masque_test(publication()[1], test_size=0.2, random_state=9001)
+
+    X_dt_test, y_dt_test = X_dt[test], y_dt[test]
+    X_dl_test, y_dl_test = X_dl[test], y_dl[test]
+    X_ts_test, y_ts_test = X_ts[test], y_ts[test]
+
+    return (scaler, scaler2,
+            X_dt_test, y_dt_test,
+            X_dl_test, y_dl_test,
+            X_ts_test, y_ts_test)
+
+# Prédictions sur l'échantillon de test, calculées une fois par modèle
+@st.cache_resource(max_entries=len(FICHIERS_MODELES))
+def predictions_test(option, empreinte):
+    (scaler, scaler2,
+     X_dt_test, y_dt_test,
+     X_dl_test, y_dl_test,
+     X_ts_test, y_ts_test) = preparation_modelisation()
+    model = chargement_modele(option, empreinte)
+
+    if option == 'DecisionTree':
+        y_pred = model.predict(X_dt_test)
+        return y_pred, calcul_residus(y_pred, y_dt_test)
+    if option == 'Réseau de neurones':
+        y_pred = model.predict(X_dl_test)
+        return y_pred, calcul_residus(y_pred, y_dl_test)
+    if option == 'Modèle custom TensorFlow':
+        y_pred = model(X_ts_test[X_ts_test.columns[0]], X_ts_test[X_ts_test.columns[1]], X_ts_test[X_ts_test.columns[2]], X_ts_test[X_ts_test.columns[3]], X_ts_test[X_ts_test.columns[4]], X_ts_test[X_ts_test.columns[5]])
+        return y_pred, calcul_residus(y_pred, y_ts_test)
+
+#################################
+# Préchargement en arrière-plan #
+#################################
+
+# Lancé une seule fois par processus serveur (cache_resource), dès la première
+# exécution du script : la page s'affiche sans attendre et les sessions qui ont
+# besoin d'une ressource en cours de calcul attendent le même calcul au lieu
+# de le dupliquer. Le fichier FICHIER_PRET sert de sonde de disponibilité
+# (readiness) pour les déploiements progressifs. Il identifie le processus qui
+# l'a écrit (pid et date de démarrage) : `disponibilite.py verifier` ignore le
+# fichier laissé par un processus précédent. Le script ne s'exécute qu'à
+# l'ouverture d'une session, `disponibilite.py prechauffer` en ouvre une au
+# démarrage du conteneur.
+@st.cache_resource
+def prechargement():
+    etat = {"pret": False, "erreur": None, "debut": time.time(), "duree": None}
+    FICHIER_PRET.unlink(missing_ok=True)
+
+    def tache():
+        # Ce thread n'est rattaché à aucune session : on coupe l'avertissement
+        # "missing ScriptRunContext" émis à chaque appel de fonction en cache
+        logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+        try:
+            preparation_modelisation()
+            for option in FICHIERS_MODELES:
+                predictions_test(option, empreinte_artefact(option))
+            etat["duree"] = time.time() - etat["debut"]
+            etat["pret"] = True
+            FICHIER_PRET.parent.mkdir(parents=True, exist_ok=True)
+            tmp = FICHIER_PRET.with_name(FICHIER_PRET.name + f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({"pid": os.getpid(), "debut_processus": debut_processus(),
+                                       "duree_s": round(etat["duree"], 1)}))
+            os.replace(tmp, FICHIER_PRET)
+        except Exception as e:
+            etat["erreur"] = repr(e)
+
+    threading.Thread(target=tache, name="prechargement", daemon=True).start()
+    return etat
+
 #################################
 # Création de la page Streamlit #
 #################################
@@ -21,9 +198,18 @@ import streamlit as st
 st.title("Emission de CO2 par les véhicules")
 st.sidebar.title("Sommaire")
 pages=["Présentation du projet", "Exploration", "Data Visualisation",
-    "Modélisations", "Votre prédiction", "Quelques exemples types", "Conclusions"]
+    "Modélisations", "Interprétabilité", "Votre prédiction", "Quelques exemples types", "Conclusions"]
 page=st.sidebar.radio("Aller vers", pages)
 
+# Indicateur non bloquant de l'état du préchargement
+etat_prechargement = prechargement()
+if etat_prechargement["erreur"]:
+    st.sidebar.warning(f"Échec du préchargement : {etat_prechargement['erreur']}")
+elif etat_prechargement["pret"]:
+    st.sidebar.success(f"Données et modèles prêts ({etat_prechargement['duree']:.1f} s)")
+else:
+    st.sidebar.info("Préchargement des données et des modèles en cours…")
+
 ### Page de présentation
 if page == pages[0] : 
     st.header("Présentation du projet")
@@ -35,9 +221,8 @@ if page == pages[0] :
     st.write('La volumétrie ainsi que l’absence notable de la variable associée à la consommation de carburant dans le jeu de données européen, nous conduit à privilégier la source données de l’ADEME. Le jeu de données retenu est constitué par les données disponibles en France entre 2012 et 2015, représentant 160 826 observations.')
     
 ### Exploration des données
-file = 'data_2012-2015.csv'
-df = pd.read_csv(file, on_bad_lines="skip", sep= ',', low_memory=False)
 if page == pages[1] :
+    df = chargement_dataset()[0]
     st.header("Exploration des données")
     st.write('Nous nous intéressons aux données des véhicules enregistrés France entre 2012 et 2015.')
     st.subheader("Aperçu du jeu de données")
@@ -55,35 +240,19 @@ if page == pages[1] :
 if page == pages[2] : 
     st.header("Data Vizualization")
 
+    # Les figures sont servies depuis le cache des specs (une lecture par visite)
+    specs = specs_visualisation(Path(publication()[0]).stem, version_visualisation())
+
     # Heatmap
     st.subheader('Heatmap')
     st.write("Afin de pouvoir déterminer plus facilement les variables numériques à cibler, il est possible de créer une heatmap. Un intérêt particulier sera donné aux variables ayant un fort degré de corrélation (le plus éloigné de 0) avec la variable cible : CO2 (g/km).")
-    variables_num = df.select_dtypes(include = ['int64', 'float64'])
-    cor = variables_num.corr()
-    fig_heatmap = px.imshow(cor)
-    st.plotly_chart(fig_heatmap) 
+    st.plotly_chart(pio.from_json(specs["heatmap"])) 
     st.write("Plusieurs variables sont corrélées avec la variable cible, notamment une, avec un degré de corrélation très élevé (0.97) : la Consommation mixte (l/100km), qui, comme son nom l’indique, donne la consommation en carburant du véhicule en litre pour 100 km (urbaine et extra-urbaine).") 
     st.write("Observons plus en détail la relation entre consommation mixte et émissions de CO2.")
 
     # Nuage de points conso mixte et CO2
-    dictionnaire_carburant = {"GO":"Gazole",
-             "ES":"Essence",
-             "EH":"Essence",
-             "GH":"Gazole",
-             "ES/GN":"Essence",
-             "GN/ES":"Gaz Naturel Vehicule (GNV)",
-             "ES/GP":"Essence",
-             "GP/ES":"Gaz de Petrole Liquefie (GPL)",
-             "EL":"Electrique",
-             "GN":"Gaz Naturel Vehicule (GNV)",
-             "EE":"Essence",
-             "FE":"SuperEthanol-E85",
-             "GL":"Gazole"}
     st.subheader('Nuage de points - émissions de CO2 (g/km) en fonction de la consommation mixte (l/100km) selon le carburant utilisé')
-    df['Carburant'] = df['Carburant'].replace(dictionnaire_carburant)
-    fig_scatter = px.scatter(df, x="Consommation mixte (l/100km)", y="CO2 (g/km)", color = 'Carburant',
-                 title='CO2 émis selon la consommation de carburant mixte et le type de carburant utilisé')
-    st.plotly_chart(fig_scatter) 
+    st.plotly_chart(pio.from_json(specs["nuage"])) 
     st.write("Comme attendu, les points se regroupent de façon linéaire, ce qui signifie que cette variable nous sera utile pour prédire les émissions.")
     st.write("Toutefois, plusieurs droites semblent se dessiner. Cela indique donc qu'une variable supplémentaire affecte les résultats, certainement une variable catégorielle : le carburant.")
     st.write("La faible présence sur le graphique de véhicules utilisant un carburant autre que l’essence ou le gazole indique un potentiel déséquilibre dans le jeu de données. Observons cela de plus près.")
@@ -91,169 +260,22 @@ if page == pages[2] :
     # Répartition des carburants
     st.subheader("Proportion de chaque type de motorisation")
     # Pie Chart
-    occurence = []
-    l = df['Carburant'].unique()
-    for i in range (len(l)) :
-        occurence.append(df.loc[df['Carburant'] == l[i]].count()[0])
-    from plotly.subplots import make_subplots
-    fig = make_subplots(rows = 1,
-                    cols = 2,
-                    specs=[[{'type':'domain'}, {'type':'domain'}]],
-                    subplot_titles = ['Répartition globale', 'Zoom'],
-                    )
-
-    colors = ['lightblue','green','lightseagreen','antiquewhite','cadetblue','darkorange','goldenrod']
-    fig.add_trace(go.Pie(labels = l,
-                     values = occurence,
-                     marker_line = dict(color = 'black', width = 1.5), # Couleur et épaisseur de la ligne
-                     marker_colors = colors,  # Couleur de chaque partie du camembert
-                     pull = [0,0.1,0,0,0,0],
-                      name = 'Global'),
-                      row = 1, col = 1)
-
-    l_1 = np.delete(l, [0,1])
-    occurence_sans_maj = []
-    for i in range (len(l_1)) :
-        occurence_sans_maj.append(df.loc[df['Carburant'] == l_1[i]].count()[0])
-
-    fig.add_trace(go.Pie(labels = l_1,
-                      values = occurence_sans_maj,
-                    name = 'Zoom'),
-                    row = 1, col = 2)
-
-    fig.update_layout(title="Types de carburants des véhicules enregistrés en France entre 2012 et 2015",showlegend=True, legend_title = 'Légende')
-    st.plotly_chart(fig) 
+    st.plotly_chart(pio.from_json(specs["repartition"])) 
     st.write("Il y a une très forte représentation de véhicules utilisant du gazole comme carburant (84,2%), et dans une bien moindre mesure, les véhicules essence (15.3%). Les quatre autres motorisations ne représentent au final qu'un total de 0.5% du jeu de données restant. Ce déséquilibre entre les types de carburants présents peut entraîner un biais qui peut fausser les prédictions d’émission des véhicules utilisant ces types de carburants sous-représentés.")
 
     # Boîte à moustache
     st.subheader("Boîte à moustaches (Box plot) de l'émission de CO2 (g/km) en fonction du type de carburant")
     st.write("Le graphique ci-dessous doit nous permettre de vérifier la distribution des valeurs d’émissions des véhicules selon le type de carburant utilisé, afin, entre autre, de faire apparaître d’éventuelles valeurs aberrantes.")
-    fig_boxplot = px.box(df, x = 'Carburant', y = 'CO2 (g/km)')
-    st.plotly_chart(fig_boxplot)
+    # Quartiles et moustaches calculés côté serveur, valeurs aberrantes échantillonnées
+    st.plotly_chart(pio.from_json(specs["boites"]))
     st.write("La présence de points hors des boîtes (notamment dans la catégorie gazole) indique la présence de valeurs éloignées du reste des autres valeurs. Toutefois, leurs écarts ne semblent pas significatifs, ce qui signifie que ces valeurs, bien que extrêmes, restent valables et peuvent donc être gardées dans le jeu de données.")
 
-################
-# Modélisation #
-################
-
-class CustomRegression():
-    def __init__(self):
-            
-        self.w_c1 = tf.Variable(tf.random.normal([1]), name='weight_carb_1')
-        self.w_c2 = tf.Variable(tf.random.normal([1]), name='weight_carb_2')
-        self.w_c3 = tf.Variable(tf.random.normal([1]), name='weight_carb_3')
-        self.w_c4 = tf.Variable(tf.random.normal([1]), name='weight_carb_4')
-        self.w_c5 = tf.Variable(tf.random.normal([1]), name='weight_carb_5')
-
-        self.b_c1 = tf.Variable(tf.random.normal([1]), name='bias_carb_1')
-        self.b_c2 = tf.Variable(tf.random.normal([1]), name='bias_carb_2')
-        self.b_c3 = tf.Variable(tf.random.normal([1]), name='bias_carb_3')
-        self.b_c4 = tf.Variable(tf.random.normal([1]), name='bias_carb_4')
-        self.b_c5 = tf.Variable(tf.random.normal([1]), name='bias_carb_5')
-
-    def __call__(self, conso, carb1, carb2, carb3, carb4, carb5):
-
-        conso = tf.convert_to_tensor(conso, dtype=tf.float32)
-
-        carb1 = tf.convert_to_tensor(carb1, dtype=tf.float32)
-        carb2 = tf.convert_to_tensor(carb2, dtype=tf.float32)
-        carb3 = tf.convert_to_tensor(carb3, dtype=tf.float32)
-        carb4 = tf.convert_to_tensor(carb4, dtype=tf.float32)
-        carb5 = tf.convert_to_tensor(carb5, dtype=tf.float32)
-            
-        return carb1 * (conso * self.w_c1 + self.b_c1) + carb2 * (conso * self.w_c2 + self.b_c2) + carb3 * (conso * self.w_c3 + self.b_c3) + carb4 * (conso * self.w_c4 + self.b_c4) + carb5 * (conso * self.w_c5 + self.b_c5)
-
-def affichage_metrics(residus, y_pred, y_test):
-    st.write("MSQE : {:.2f}".format(mean_squared_error(y_test, y_pred)))
-    st.write("MAE : {:.2f}".format(mean_absolute_error(y_test, y_pred)))
-
-    st.write("\nProportion < 1% d'ecart  : {:.2f}%".format((len(residus[residus<1]) / len(residus)) * 100))
-    st.write("Proportion < 5% d'ecart  : {:.2f}%".format((len(residus[residus<5]) / len(residus)) * 100))
-    st.write("Proportion < 10% d'ecart : {:.2f}%".format((len(residus[residus<10]) / len(residus)) * 100))
-
-def calcul_residus(y_pred, y_test):
-    residus = []
-    for i in range(len(y_test)):
-        residus.append(((y_pred[i] - y_test.values[i]) / y_test.values[i]) * 100)
-
-    return np.absolute(residus)
-
-###############################################
-# Chargement et préparation du jeu de données #
-###############################################
-
-@st.cache_data
-def chargement_dataset():
-    #scaler = StandardScaler()
-    encoder_le =  LabelEncoder()
-
-    file = 'data_2012-2015.csv'
-    df_original = pd.read_csv(file, on_bad_lines="skip", sep= ',', low_memory=False)
-
-    liste_cbr = {"GO":"Gazole",
-                "ES":"Essence",
-                "EH":"Essence",
-                "GH":"Gazole",
-                "ES/GN":"Essence",
-                "GN/ES":"Gaz Naturel Vehicule (GNV)",
-                "ES/GP":"Essence",
-                "GP/ES":"Gaz de Petrole Liquefié (GPL)",
-                "EL":"Electrique",
-                "GN":"Gaz Naturel Vehicule (GNV)",
-                "EE":"Essence",
-                "FE":"SuperEthanol-E85",
-                "GL":"Gazole"}
-
-    df_original["Carburant"] = df_original["Carburant"].replace(liste_cbr)
-
-    df = df_original[["Consommation mixte (l/100km)", "Carburant", "CO2 (g/km)", "Puissance administrative","masse vide euro min (kg)"]]
-    df = df.dropna(how="any")
-
-    df_carb = pd.get_dummies(df["Carburant"])
-    df_carb = df_carb.replace({True:1, False:0})
-
-    df["Carburant"] = encoder_le.fit_transform(df["Carburant"])
-
-    X_dt = df.drop(columns="CO2 (g/km)")
-    X_dl = pd.concat([df[["Consommation mixte (l/100km)", "Puissance administrative","masse vide euro min (kg)"]], df_carb], axis=1)
-    X_ts = pd.concat([df["Consommation mixte (l/100km)"], df_carb], axis=1)
-
-    y_dt = df["CO2 (g/km)"]
-    y_dl = df["CO2 (g/km)"]
-    y_ts = df["CO2 (g/km)"]
-
-    return df_original, X_dt, y_dt, X_dl, y_dl, X_ts, y_ts
-
-##########################
-# Chargement des modèles #
-##########################
-
-@st.cache_data
-def chargement_models():
-
-    # Chargement du modèle DecisionTree
-    model_dt = load("decision_tree")
-
-    # Chargement du réseau de neurones
-    model_dl = load("model_dl2")
-
-    # Chargement du modèle custom TensorFlow
-    model_tf = load("model_tf_france")
-
-    return model_dt, model_dl, model_tf
-
-df_original, X_dt, y_dt, X_dl, y_dl, X_ts, y_ts = chargement_dataset()
-
-scaler = StandardScaler()
-X_dt = scaler.fit_transform(X_dt)
-scaler2 = StandardScaler()
-X_dl = scaler2.fit_transform(X_dl)
-
-X_dt_train, X_dt_test, y_dt_train, y_dt_test = train_test_split(X_dt, y_dt, test_size=0.2, random_state=9001)
-X_dl_train, X_dl_test, y_dl_train, y_dl_test = train_test_split(X_dl, y_dl, test_size=0.2, random_state=9001)
-X_ts_train, X_ts_test, y_ts_train, y_ts_test = train_test_split(X_ts, y_ts, test_size=0.2, random_state=9001)
-
-model_dt, model_dl, model_tf = chargement_models()
+if page in pages[3:5]:
+    (scaler, scaler2,
+     X_dt_test, y_dt_test,
+     X_dl_test, y_dl_test,
+     X_ts_test, y_ts_test) = preparation_modelisation()
+    model_dt, model_dl, model_tf = chargement_models()
 
 if page == pages[3] : 
     st.header("Modélisations")
@@ -266,8 +288,7 @@ if page == pages[3] :
     # Prédiction avec le modèle DecisionTree
     if option == 'DecisionTree':
         st.subheader("Métriques d'évaluations")
-        y_pred = model_dt.predict(X_dt_test) 
-        residus = calcul_residus(y_pred, y_dt_test)
+        y_pred, residus = predictions_test(option, empreinte_artefact(option))
         affichage_metrics(residus, y_pred, y_dt_test)
         
         st.subheader("Prédictions du modèle vs Valeurs réelles")
@@ -286,8 +307,7 @@ if page == pages[3] :
     # Prédiction avec le réseau de neurones
     if option == 'Réseau de neurones':
       st.subheader("Métriques d'évaluations")
-      y_pred = model_dl.predict(X_dl_test)
-      residus = calcul_residus(y_pred, y_dl_test)
+      y_pred, residus = predictions_test(option, empreinte_artefact(option))
       affichage_metrics(residus, y_pred, y_dl_test)
       
       st.subheader("Prédictions du modèle vs Valeurs réelles")
@@ -309,8 +329,7 @@ if page == pages[3] :
     # Prédiction avec le modèle custom TensorFlow
     if option == 'Modèle custom TensorFlow':
       st.subheader("Métriques d'évaluations")
-      y_pred = model_tf(X_ts_test[X_ts_test.columns[0]], X_ts_test[X_ts_test.columns[1]], X_ts_test[X_ts_test.columns[2]], X_ts_test[X_ts_test.columns[3]], X_ts_test[X_ts_test.columns[4]], X_ts_test[X_ts_test.columns[5]])
-      residus = calcul_residus(y_pred, y_ts_test)
+      y_pred, residus = predictions_test(option, empreinte_artefact(option))
       affichage_metrics(residus, y_pred, y_ts_test)
       
       st.subheader("Prédictions du modèle vs Valeurs réelles")
@@ -328,18 +347,110 @@ if page == pages[3] :
       st.write("Nous avons ainsi créé une class CustomRegression pour définir ce modèle à 10 variables (la pente et l’ordonnée à l’origine des 5 régressions linéaires) ainsi qu’une fonction d’entraînement de ce modèle utilisant la méthode du gradient avec les éléments disponibles de tensorflow.")
       st.write("Ce modèle est finalement celui que l’on retient à l’issue de notre travail.")
 
+####################
+# Interprétabilité #
+####################
+
+def fonction_prediction(option, empreinte):
+    model = chargement_modele(option, empreinte)
+    if option == 'DecisionTree':
+        return model.predict
+    if option == 'Réseau de neurones':
+        return lambda X: model.predict(X, batch_size=8192, verbose=0).ravel()
+    if option == 'Modèle custom TensorFlow':
+        return lambda X: model(*[X[:, i] for i in range(X.shape[1])])
+
+def espace_modele(option):
+    # Matrice de test du modèle, groupes de colonnes permutées ensemble, scaler
+    # éventuel et colonnes des courbes de dépendance partielle
+    (scaler, scaler2,
+     X_dt_test, y_dt_test,
+     X_dl_test, y_dl_test,
+     X_ts_test, y_ts_test) = preparation_modelisation()
+
+    if option == 'DecisionTree':
+        groupes = {"Consommation mixte (l/100km)": 0, "Carburant": 1, "Puissance administrative": 2, "masse vide euro min (kg)": 3}
+        return X_dt_test, y_dt_test, groupes, scaler, {"Consommation mixte (l/100km)": 0, "masse vide euro min (kg)": 3}
+    if option == 'Réseau de neurones':
+        groupes = {"Consommation mixte (l/100km)": 0, "Puissance administrative": 1, "masse vide euro min (kg)": 2, "Carburant": [3, 4, 5, 6, 7]}
+        return X_dl_test, y_dl_test, groupes, scaler2, {"Consommation mixte (l/100km)": 0, "masse vide euro min (kg)": 2}
+    if option == 'Modèle custom TensorFlow':
+        groupes = {"Consommation mixte (l/100km)": 0, "Carburant": [1, 2, 3, 4, 5]}
+        return X_ts_test, y_ts_test, groupes, None, {"Consommation mixte (l/100km)": 0}
+
+# Résultats mis en cache sur disque par artefact de modèle et jeu de features :
+# `empreinte` change dès que le modèle est réentraîné, `jeu` dès que le
+# prétraitement est modifié et `version` avec le code des calculs. Le modèle
+# évalué est celui de cette empreinte.
+@st.cache_data(persist="disk", show_spinner="Calcul de l'interprétabilité du modèle…")
+def interpretation_modele(option, empreinte, jeu, version, n_repetitions, n_echantillon):
+    predict = fonction_prediction(option, empreinte)
+    X_test, y_test, groupes, scaler_modele, colonnes_pdp = espace_modele(option)
+    X_test = np.asarray(X_test, dtype="float64")
+
+    importances, mae_base = importance_permutation(predict, X_test, y_test, groupes, n_repetitions, n_echantillon)
+
+    courbes = {}
+    for nom, j in colonnes_pdp.items():
+        # Grille en unités d'origine, convertie dans l'espace normalisé du modèle
+        moyenne, echelle = (scaler_modele.mean_[j], scaler_modele.scale_[j]) if scaler_modele is not None else (0.0, 1.0)
+        grille = np.unique(np.quantile(X_test[:, j] * echelle + moyenne, np.linspace(0.02, 0.98, 25)))
+        y_moyen = dependance_partielle(predict, X_test, j, (grille - moyenne) / echelle, n_echantillon)
+        courbes[nom] = pd.DataFrame({nom: grille, "CO2 prédit (g/km)": y_moyen})
+
+    return importances, mae_base, courbes
+
+if page == pages[4] : 
+    st.header("Interprétabilité")
+    st.write("L’importance par permutation mesure la dégradation de la MAE lorsque les valeurs d’une variable sont mélangées aléatoirement : plus l’erreur augmente, plus le modèle s’appuie sur cette variable. Les courbes de dépendance partielle montrent l’émission moyenne prédite lorsque l’on fait varier une seule variable, les autres restant inchangées.")
+    choix = ['DecisionTree', 'Réseau de neurones'
+             , 'Modèle custom TensorFlow']
+    option = st.selectbox('Choix du modèle', choix)
+    n_repetitions = st.slider("Nombre de permutations par variable", 2, 30, 10)
+    if st.checkbox("Calculer sur un sous-échantillon du jeu de test", value=True):
+        n_echantillon = st.select_slider("Taille du sous-échantillon", options=[1000, 2000, 5000, 10000], value=5000)
+    else:
+        n_echantillon = None
+
+    importances, mae_base, courbes = interpretation_modele(option, empreinte_artefact(option), Path(publication()[1]).stem,
+                                                      version_interpretabilite(), n_repetitions, n_echantillon)
+
+    st.subheader("Importance des variables par permutation")
+    st.write(f"MAE de référence : {mae_base:.2f}. Les barres d’erreur donnent l’intervalle de confiance à 95 %.")
+    fig = go.Figure(go.Bar(x=importances["importance"], y=importances.index, orientation="h",
+                           error_x=dict(type="data", symmetric=False,
+                                        array=importances["ic_haut"] - importances["importance"],
+                                        arrayminus=importances["importance"] - importances["ic_bas"])))
+    fig.update_layout(xaxis_title="Augmentation de la MAE (g/km)", yaxis=dict(autorange="reversed"))
+    st.plotly_chart(fig)
+    st.dataframe(importances)
+
+    st.subheader("Dépendance partielle")
+    for nom, courbe in courbes.items():
+        st.plotly_chart(px.line(courbe, x=nom, y="CO2 prédit (g/km)", markers=True))
+
 #######################
 # Faire sa prédiction #
 #######################
 
+# Les pages "Votre prédiction" et "Quelques exemples types" sont des fragments :
+# un mouvement de slider ne réexécute que la fonction du fragment (saisie,
+# mise en forme et appel du modèle), sans repasser par le reste du script.
+# Scalers et modèles sont récupérés dans les caches de ressources.
+
+# Bornes et valeurs par défaut des sliders, calculées une fois par jeu de données
+@st.cache_data(show_spinner=False)
+def bornes_saisie(empreinte):
+    df = chargement_dataset()[0]
+    colonnes = ['Consommation mixte (l/100km)', 'Puissance administrative', 'masse vide euro min (kg)']
+    return {col: (float(df[col].min()), float(df[col].max()), float(df[col].mean())) for col in colonnes}
+
 def user_input_features():
-    Consommation_mixte = st.slider('Consommation mixte (l/100km)', float(df['Consommation mixte (l/100km)'].min()),
-                                            float(df['Consommation mixte (l/100km)'].max()),  df['Consommation mixte (l/100km)'].mean())
+    bornes = bornes_saisie(Path(publication()[0]).stem)
+    Consommation_mixte = st.slider('Consommation mixte (l/100km)', *bornes['Consommation mixte (l/100km)'])
     Carburant = st.select_slider(label = 'Choisissez votre type de carburant',options = ['Essence', 'Gaz Naturel Vehicule (GNV)', 'Gaz de Petrole Liquefié (GPL)', 'Gazole', 'SuperEthanol-E85'])
-    Puissance_administrative = st.slider('Puissance administrative', float(df['Puissance administrative'].min()),
-                                            float(df['Puissance administrative'].max()),  df['Puissance administrative'].mean())
-    masse_vide_euro_min = st.slider('masse vide euro min (kg)', float(df['masse vide euro min (kg)'].min()),
-                                            float(df['masse vide euro min (kg)'].max()),  df['masse vide euro min (kg)'].mean())
+    Puissance_administrative = st.slider('Puissance administrative', *bornes['Puissance administrative'])
+    masse_vide_euro_min = st.slider('masse vide euro min (kg)', *bornes['masse vide euro min (kg)'])
     DATA = {'Consommation mixte (l/100km)' :  Consommation_mixte,
             "Carburant" : Carburant,
         'Puissance administrative' : Puissance_administrative,
@@ -363,21 +474,32 @@ def construction_col_car(df):
         df[carb] = df['Carburant'].apply(lambda x: 1 if x == carb else 0)
     return df
 
-if page == pages[4] : 
-    st.header("Votre prédiction")
+def saisie_utilisateur(validation):
+    # Avec validation, les sliders sont regroupés dans un formulaire : le modèle
+    # n'est appelé qu'au clic, et non à chaque position intermédiaire du curseur
+    if not validation:
+        return user_input_features()
+    with st.form("saisie_prediction"):
+        df_user = user_input_features()
+        st.form_submit_button("Prédire")
+    return df_user
+
+@st.fragment
+def fragment_prediction(validation):
     choix = ['DecisionTree', 'Réseau de neurones'
              , 'Modèle custom TensorFlow']
     option = st.selectbox('Choix du modèle', choix)
     st.write('Le modèle choisi est :', option)
 
+    scaler, scaler2 = preparation_modelisation()[:2]
+    model_dt, model_dl, model_tf = chargement_models()
+
     if option == 'DecisionTree':
         st.subheader("Prédiction avec le décision tree")
-        df_user = user_input_features()
+        df_user = saisie_utilisateur(validation)
         st.dataframe(df_user)
         # modification de X_pred pour correspondre au format attendu par le modèle
         X_pred_dt = labelisation_carburant(df_user)
-        #scaler = StandardScaler()
-        #a = scaler.fit(X)
         X_pred_dt = scaler.transform(X_pred_dt)
         # prédiciton avec le décision tree
         y_pred_dt = model_dt.predict(X_pred_dt)
@@ -385,27 +507,24 @@ if page == pages[4] :
 
     if option == 'Réseau de neurones':
         st.subheader("Les fonctionnalités de votre voiture")
-        # sidebar
-        st.sidebar.header('Entrez vos paramètres')
         # affichage des paramètres choisis
-        df_user = user_input_features()
+        df_user = saisie_utilisateur(validation)
         st.dataframe(df_user)
 
         st.subheader("Prédiction avec notre custom model")
         df_user_carb = construction_col_car(df_user)
         X_pred_dl = df_user_carb[['Consommation mixte (l/100km)', 'Puissance administrative', 'masse vide euro min (kg)', 'Essence', 'Gaz Naturel Vehicule (GNV)', 'Gaz de Petrole Liquefié (GPL)', 'Gazole', 'SuperEthanol-E85']]
         X_pred_dl = scaler2.transform(X_pred_dl)
-        # prédiciton avec le décision tree
-        y_pred_dl = model_dl.predict(X_pred_dl)
+        # Appel direct du modèle sur une ligne : évite le coût fixe de predict()
+        # (boucle de batchs, barre de progression) et ne partage pas sa fonction
+        # compilée avec le préchargement en arrière-plan
+        y_pred_dl = model_dl(X_pred_dl, training=False).numpy()
         st.write(f"Les émissions de CO2 prédites par le réseau de neurones pour ce modèle de voiture est {y_pred_dl[0][0]} grammes par kilomètre.") 
 
-
     if option == 'Modèle custom TensorFlow':
         st.subheader("Les fonctionnalités de votre voiture")
-        # sidebar
-        st.sidebar.header('Entrez vos paramètres')
         # affichage des paramètres choisis
-        df_user = user_input_features()
+        df_user = saisie_utilisateur(validation)
         st.dataframe(df_user)
 
         st.subheader("Prédiction avec notre custom model")
@@ -418,11 +537,20 @@ if page == pages[4] :
         st.write(f"Les émissions de CO2 prédites pour ce modèle de voiture est {y_pred_tf[0]} grammes par kilomètre.") 
 
 if page == pages[5] : 
-    st.header("Quelques prédictions pour des voitures que l'on connaît tous")
+    st.header("Votre prédiction")
+    # Les widgets de la barre latérale ne peuvent pas vivre dans un fragment
+    st.sidebar.header('Entrez vos paramètres')
+    validation = st.sidebar.toggle("Prédire seulement à la validation", value=False)
+    fragment_prediction(validation)
+
+@st.fragment
+def fragment_exemples():
     choix = ['Renault Megane', 'Renault Espace']
     option = st.selectbox('Choix du modèle de voiture', choix)
     st.write('La voiture choisie est :', option)
 
+    model_tf = chargement_models()[2]
+
     if option == 'Renault Megane':
         # ajout des valeurs de conso mixte et de type de carburant
         X_megane = [1.4, 1, 0, 0, 0, 0]
@@ -433,5 +561,8 @@ if page == pages[5] :
         # ajout des valeurs de conso mixte et de type de carburant
         X_espace = [4.7, 1, 0, 0, 0, 0]
         y_espace =  model_tf(X_espace[0], X_espace[1], X_espace[2], X_espace[3], X_espace[4], X_espace[5])
-        st.write(f"Les émissions de CO2 prédites pour ce modèle de voiture est {y_espace[0]} grammes par kilomètre.") 
+        st.write(f"Les émissions de CO2 prédites pour ce modèle de voiture est {y_espace[0]} grammes par kilomètre.")
 
+if page == pages[6] : 
+    st.header("Quelques prédictions pour des voitures que l'on connaît tous")
+    fragment_exemples()
@@ -0,0 +1,237 @@
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import plotly.express as px
+from streamlit import config
+from streamlit.runtime import Runtime
+from streamlit.testing.v1 import AppTest
+
+# psutil est optionnel : à défaut la mémoire résidente est lue dans /proc (Linux)
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Test de charge local de l'application : N sessions simulées (une instance
+# AppTest par session, chacune dans son thread) parcourent les pages dans le
+# même processus, comme les sessions d'un serveur Streamlit, et partagent donc
+# les mêmes caches. À lancer depuis src/streamlit, comme `streamlit run`.
+#
+#   python charge_app.py --sessions 1 4 8 16 --visites 10
+#
+# Remarque : AppTest réexécute tout le script à chaque interaction (les
+# fragments ne sont pas isolés) : les latences mesurées sont des bornes hautes.
+
+SCRIPT = Path(__file__).resolve().with_name("Streamlit_CO2_20240910.py")
+DOSSIER_RAPPORTS = Path(__file__).resolve().parents[2] / "reports"
+
+PAGES = ["Présentation du projet", "Exploration", "Data Visualisation", "Modélisations",
+         "Interprétabilité", "Votre prédiction", "Quelques exemples types", "Conclusions"]
+
+########################
+# Mémoire du processus #
+########################
+
+def memoire_rss():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    # Deuxième champ de /proc/self/statm : pages résidentes
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def echantillonnage_memoire(releves, arret, periode=0.5):
+    debut = time.perf_counter()
+    while True:
+        releves.append({"t_s": time.perf_counter() - debut, "rss_mo": memoire_rss() / 2**20})
+        if arret.wait(periode):
+            return
+
+
+#####################
+# Sessions simulées #
+#####################
+
+# AppTest installe un Runtime factice global et l'option "global.appTest" au
+# début de chaque exécution, et les retire à la fin : avec plusieurs sessions en
+# parallèle, la fin d'une exécution les retirerait à celles encore en cours.
+# Pendant le test de charge, l'option est fixée et le dernier Runtime installé
+# reste visible.
+def sessions_concurrentes():
+    config.set_option("global.appTest", True)
+    dernier = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            dernier["runtime"] = cls._instance
+        if "runtime" not in dernier:
+            raise RuntimeError("Runtime hasn't been created!")
+        return dernier["runtime"]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or "runtime" in dernier)
+
+
+def saisie_aleatoire(at, rng):
+    # Une interaction = un widget de la page qui prend une nouvelle valeur
+    # aléatoire, comme un mouvement de curseur dans le navigateur
+    widgets = list(at.main.slider) + list(at.main.select_slider) + list(at.main.selectbox)
+    if not widgets:
+        return False
+    widget = rng.choice(widgets)
+    if widget.type in ("select_slider", "selectbox"):
+        widget.set_value(rng.choice(widget.options))
+    elif isinstance(widget.value, int):
+        widget.set_value(rng.randint(widget.min, widget.max))
+    else:
+        widget.set_value(rng.uniform(widget.min, widget.max))
+    return True
+
+
+def execution_mesuree(at, mesures, session, page, action):
+    debut = time.perf_counter()
+    at.run()
+    mesures.append({"session": session, "page": page, "action": action, "debut": debut,
+                    "duree_s": time.perf_counter() - debut,
+                    "erreur": at.exception[0].value if len(at.exception) else None})
+
+
+def session(numero, pages, n_visites, n_interactions, graine, mesures, timeout=300):
+    rng = random.Random(graine * 1000 + numero)
+    at = AppTest.from_file(str(SCRIPT), default_timeout=timeout)
+    execution_mesuree(at, mesures, numero, PAGES[0], "ouverture")
+
+    for _ in range(n_visites):
+        page = rng.choice(pages)
+        at.sidebar.radio[0].set_value(page)
+        execution_mesuree(at, mesures, numero, page, "navigation")
+        for _ in range(n_interactions):
+            if not saisie_aleatoire(at, rng):
+                break
+            execution_mesuree(at, mesures, numero, page, "interaction")
+
+
+def palier(n_sessions, pages, n_visites, n_interactions, graine):
+    # Toutes les sessions démarrent ensemble ; la mémoire est relevée en continu
+    mesures, releves, arret = [], [], threading.Event()
+    echantillonneur = threading.Thread(target=echantillonnage_memoire, args=(releves, arret), daemon=True)
+    echantillonneur.start()
+
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_sessions) as pool:
+        taches = [pool.submit(session, i, pages, n_visites, n_interactions, graine, mesures)
+                  for i in range(n_sessions)]
+        for tache in taches:
+            tache.result()
+    duree = time.perf_counter() - debut
+
+    arret.set()
+    echantillonneur.join()
+    mesures = pd.DataFrame(mesures).assign(sessions=n_sessions, debut=lambda d: d["debut"] - debut)
+    return mesures, pd.DataFrame(releves).assign(sessions=n_sessions), duree
+
+
+###########
+# Rapport #
+###########
+
+def synthese(mesures, memoire, durees, rss_base):
+    latences = mesures.groupby(["sessions", "page"])["duree_s"].agg(
+        executions="count",
+        p50_ms=lambda d: d.quantile(0.50) * 1e3,
+        p90_ms=lambda d: d.quantile(0.90) * 1e3,
+        p99_ms=lambda d: d.quantile(0.99) * 1e3,
+        max_ms=lambda d: d.max() * 1e3,
+    )
+    latences["erreurs"] = mesures.groupby(["sessions", "page"])["erreur"].count()
+
+    paliers = mesures.groupby("sessions").agg(executions=("duree_s", "count"), erreurs=("erreur", "count"),
+                                              p50_ms=("duree_s", lambda d: d.quantile(0.50) * 1e3),
+                                              p99_ms=("duree_s", lambda d: d.quantile(0.99) * 1e3))
+    paliers["duree_s"] = pd.Series(durees)
+    # Débit en réexécutions de script par seconde : il cesse de croître avec
+    # le nombre de sessions lorsque le processus est saturé
+    paliers["debit_par_s"] = paliers["executions"] / paliers["duree_s"]
+    paliers["rss_max_mo"] = memoire.groupby("sessions")["rss_mo"].max()
+    paliers["rss_par_session_mo"] = (paliers["rss_max_mo"] - rss_base) / paliers.index
+    return latences, paliers
+
+
+def ecriture_rapport(dossier, mesures, memoire, latences, paliers):
+    dossier.mkdir(parents=True, exist_ok=True)
+    mesures.to_csv(dossier / "mesures.csv", index=False)
+    memoire.to_csv(dossier / "memoire.csv", index=False)
+    latences.to_csv(dossier / "latences.csv")
+    paliers.to_csv(dossier / "paliers.csv")
+
+    figures = [
+        px.box(mesures.assign(duree_ms=mesures["duree_s"] * 1e3), x="page", y="duree_ms", color="sessions",
+               log_y=True, title="Latence des réexécutions par page et nombre de sessions"),
+        px.line(paliers.reset_index(), x="sessions", y="debit_par_s", markers=True,
+                title="Débit (réexécutions par seconde) selon le nombre de sessions"),
+        px.line(memoire, x="t_s", y="rss_mo", color="sessions", title="Mémoire résidente du processus (Mo)"),
+    ]
+    with open(dossier / "rapport.html", "w", encoding="utf-8") as f:
+        f.write("<html><head><meta charset='utf-8'><title>Test de charge</title></head><body>")
+        f.write(paliers.round(2).to_html())
+        f.write(latences.round(1).to_html())
+        for i, fig in enumerate(figures):
+            f.write(fig.to_html(full_html=False, include_plotlyjs="cdn" if i == 0 else False))
+        f.write("</body></html>")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge local de l'application Streamlit")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Nombres de sessions simultanées, un palier par valeur")
+    parser.add_argument("--visites", type=int, default=10, help="Pages visitées par session")
+    parser.add_argument("--interactions", type=int, default=3, help="Saisies aléatoires par page visitée")
+    parser.add_argument("--pages", nargs="+", default=PAGES, choices=PAGES)
+    parser.add_argument("--graine", type=int, default=9001)
+    parser.add_argument("--sans-echauffement", action="store_true",
+                        help="Mesure aussi le remplissage des caches (démarrage à froid)")
+    parser.add_argument("--sortie", default=None, help="Dossier du rapport")
+    args = parser.parse_args()
+
+    sessions_concurrentes()
+    if not args.sans_echauffement:
+        # Une session parcourt chaque page une fois pour remplir les caches
+        at = AppTest.from_file(str(SCRIPT), default_timeout=600)
+        at.run()
+        for page in args.pages:
+            at.sidebar.radio[0].set_value(page).run()
+        # Attente de la fin du préchargement (indicateur de la barre latérale)
+        while not (at.sidebar.success or at.sidebar.warning):
+            time.sleep(1)
+            at.run()
+    rss_base = memoire_rss() / 2**20
+
+    resultats = []
+    for n_sessions in args.sessions:
+        mesures, memoire, duree = palier(n_sessions, args.pages, args.visites, args.interactions, args.graine)
+        resultats.append((mesures, memoire, duree))
+        print(f"{n_sessions} session(s) : {len(mesures)} exécutions en {duree:.1f} s, "
+              f"p50 {mesures['duree_s'].median() * 1e3:.0f} ms, p99 {mesures['duree_s'].quantile(0.99) * 1e3:.0f} ms")
+
+    mesures = pd.concat([r[0] for r in resultats], ignore_index=True)
+    memoire = pd.concat([r[1] for r in resultats], ignore_index=True)
+    durees = {n: r[2] for n, r in zip(args.sessions, resultats)}
+    latences, paliers = synthese(mesures, memoire, durees, rss_base)
+
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.float_format", "{:.1f}".format):
+        print(paliers)
+        print(latences)
+
+    sortie = Path(args.sortie) if args.sortie else DOSSIER_RAPPORTS / f"charge_{time.strftime('%Y%m%d_%H%M%S')}"
+    ecriture_rapport(sortie, mesures, memoire, latences, paliers)
+    print(f"Rapport écrit dans {sortie}")
+
+
+if __name__ == "__main__":
+    main()
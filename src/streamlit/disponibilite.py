@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.ioloop import IOLoop
+from tornado.websocket import websocket_connect
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from src.features.build_features import DOSSIER_CACHE
+
+# Préchauffage et sonde de disponibilité de l'application pour les déploiements.
+#
+# Streamlit n'exécute le script qu'à l'ouverture d'une session : une requête
+# HTTP sur / ou /_stcore/health ne déclenche pas le préchargement. Au démarrage
+# du conteneur, après `streamlit run`, on ouvre donc une session sans navigateur
+# qui exécute le script une fois, puis on attend que les caches soient prêts :
+#
+#   python disponibilite.py prechauffer --url http://localhost:8501
+#
+# La sonde de disponibilité (readinessProbe) vérifie que le fichier FICHIER_PRET
+# a bien été écrit par le serveur en cours d'exécution (code retour 0 ou 1) :
+#
+#   python disponibilite.py verifier
+
+# Fichier écrit par l'application une fois les caches prêts ; l'application
+# importe ce chemin et debut_processus pour que l'écriture et la sonde
+# identifient le serveur de la même façon
+FICHIER_PRET = Path(os.environ.get("CO2_FICHIER_PRET", DOSSIER_CACHE / "caches_prets.json"))
+
+##########################
+# Sonde de disponibilité #
+##########################
+
+def debut_processus(pid="self"):
+    # Date de démarrage du processus en ticks depuis le boot (Linux) : distingue
+    # ce serveur d'un précédent qui aurait eu le même pid
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except OSError:
+        return None
+
+
+def etat_disponibilite(fichier=FICHIER_PRET):
+    try:
+        etat = json.loads(Path(fichier).read_text())
+    except (OSError, ValueError):
+        return False, "caches non prêts"
+
+    # Un fichier laissé par un processus arrêté (ou par un autre processus ayant
+    # réutilisé son pid) ne compte pas
+    debut = debut_processus(etat["pid"])
+    if debut is None or debut != etat.get("debut_processus"):
+        return False, f"fichier écrit par un processus terminé (pid {etat['pid']})"
+    return True, f"caches prêts (pid {etat['pid']}, {etat['duree_s']} s)"
+
+
+###########################
+# Session de préchauffage #
+###########################
+
+async def session_headless(url, timeout):
+    # Ouvre une session comme le ferait le navigateur et demande une exécution
+    # du script ; la session est refermée une fois l'exécution terminée
+    url_ws = url.rstrip("/").replace("http", "ws", 1) + "/_stcore/stream"
+    connexion = await websocket_connect(url_ws, connect_timeout=timeout)
+
+    message = BackMsg()
+    message.rerun_script.query_string = ""
+    await connexion.write_message(message.SerializeToString(), binary=True)
+
+    while True:
+        donnees = await connexion.read_message()
+        if donnees is None:
+            raise RuntimeError("Session fermée par le serveur avant la fin du script")
+        reponse = ForwardMsg()
+        reponse.ParseFromString(donnees)
+        if reponse.WhichOneof("type") == "script_finished":
+            break
+    connexion.close()
+
+
+def attente_serveur(url, timeout):
+    limite = time.time() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url.rstrip("/") + "/_stcore/health", timeout=5) as reponse:
+                if reponse.status == 200:
+                    return
+        except OSError:
+            if time.time() > limite:
+                raise
+        time.sleep(1)
+
+
+def prechauffage(url, timeout=600, fichier=FICHIER_PRET):
+    debut = time.time()
+    attente_serveur(url, timeout)
+    IOLoop.current().run_sync(lambda: session_headless(url, timeout), timeout=timeout)
+
+    # Le préchargement continue en arrière-plan dans le serveur après le script
+    while True:
+        pret, message = etat_disponibilite(fichier)
+        if pret:
+            return time.time() - debut
+        if time.time() - debut > timeout:
+            raise TimeoutError(f"Préchauffage non terminé après {timeout} s : {message}")
+        time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Préchauffage et sonde de disponibilité de l'application")
+    parser.add_argument("--fichier", default=FICHIER_PRET, help="Fichier de disponibilité écrit par l'application")
+    commandes = parser.add_subparsers(dest="commande", required=True)
+
+    prechauffer = commandes.add_parser("prechauffer", help="Ouvre une session pour déclencher le préchargement")
+    prechauffer.add_argument("--url", default="http://localhost:8501")
+    prechauffer.add_argument("--timeout", type=float, default=600)
+    commandes.add_parser("verifier", help="Code retour 0 si les caches du serveur en cours sont prêts")
+    args = parser.parse_args()
+
+    if args.commande == "prechauffer":
+        duree = prechauffage(args.url, args.timeout, args.fichier)
+        print(f"Application prête en {duree:.1f} s")
+    else:
+        pret, message = etat_disponibilite(args.fichier)
+        print(message)
+        sys.exit(0 if pret else 1)
+
+
+if __name__ == "__main__":
+    main()
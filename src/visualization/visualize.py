@@ -0,0 +1,140 @@
+import hashlib
+import inspect
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+DICTIONNAIRE_CARBURANT = {"GO":"Gazole",
+             "ES":"Essence",
+             "EH":"Essence",
+             "GH":"Gazole",
+             "ES/GN":"Essence",
+             "GN/ES":"Gaz Naturel Vehicule (GNV)",
+             "ES/GP":"Essence",
+             "GP/ES":"Gaz de Petrole Liquefie (GPL)",
+             "EL":"Electrique",
+             "GN":"Gaz Naturel Vehicule (GNV)",
+             "EE":"Essence",
+             "FE":"SuperEthanol-E85",
+             "GL":"Gazole"}
+
+##########################
+# Figures de la Data Viz #
+##########################
+
+def figure_heatmap(df):
+    variables_num = df.select_dtypes(include = ['int64', 'float64'])
+    cor = variables_num.corr()
+    return px.imshow(cor)
+
+
+def figure_nuage(df):
+    # Les points superposés (même consommation, même CO2, même carburant) sont
+    # dessinés une seule fois : le rendu est identique pour une fraction du volume
+    df = df[["Consommation mixte (l/100km)", "CO2 (g/km)", "Carburant"]].drop_duplicates()
+    return px.scatter(df, x="Consommation mixte (l/100km)", y="CO2 (g/km)", color = 'Carburant',
+                 title='CO2 émis selon la consommation de carburant mixte et le type de carburant utilisé')
+
+
+def figure_repartition(df):
+    # Comptage en une passe au lieu d'un filtre par type de carburant
+    l = df['Carburant'].unique()
+    occurence = df['Carburant'].value_counts().reindex(l).to_numpy()
+
+    fig = make_subplots(rows = 1,
+                    cols = 2,
+                    specs=[[{'type':'domain'}, {'type':'domain'}]],
+                    subplot_titles = ['Répartition globale', 'Zoom'],
+                    )
+
+    colors = ['lightblue','green','lightseagreen','antiquewhite','cadetblue','darkorange','goldenrod']
+    fig.add_trace(go.Pie(labels = l,
+                     values = occurence,
+                     marker_line = dict(color = 'black', width = 1.5), # Couleur et épaisseur de la ligne
+                     marker_colors = colors,  # Couleur de chaque partie du camembert
+                     pull = [0,0.1,0,0,0,0],
+                      name = 'Global'),
+                      row = 1, col = 1)
+
+    # Zoom sans les deux carburants majoritaires
+    fig.add_trace(go.Pie(labels = l[2:],
+                      values = occurence[2:],
+                    name = 'Zoom'),
+                    row = 1, col = 2)
+
+    fig.update_layout(title="Types de carburants des véhicules enregistrés en France entre 2012 et 2015",showlegend=True, legend_title = 'Légende')
+    return fig
+
+
+#####################################
+# Boîtes à moustaches pré-calculées #
+#####################################
+
+# Les quartiles, moustaches et valeurs aberrantes sont calculés côté serveur :
+# le navigateur ne reçoit que quelques nombres par catégorie et un échantillon
+# borné de points aberrants, au lieu de l'ensemble des observations.
+
+def statistiques_boites(df, x, y, max_aberrants=200, random_state=9001):
+    df = df[[x, y]].dropna()
+    rng = np.random.default_rng(random_state)
+
+    stats = []
+    for categorie, valeurs in df.groupby(x, sort=True)[y]:
+        valeurs = valeurs.to_numpy()
+        q1, mediane, q3 = np.percentile(valeurs, [25, 50, 75])
+        iqr = q3 - q1
+        # Moustaches de Tukey : valeurs extrêmes restant à 1.5 IQR des quartiles
+        dans_bornes = valeurs[(valeurs >= q1 - 1.5 * iqr) & (valeurs <= q3 + 1.5 * iqr)]
+        aberrants = valeurs[(valeurs < q1 - 1.5 * iqr) | (valeurs > q3 + 1.5 * iqr)]
+        n_aberrants = len(aberrants)
+        if n_aberrants > max_aberrants:
+            # On garde toujours les extrêmes pour conserver l'étendue réelle
+            echantillon = rng.choice(aberrants, max_aberrants - 2, replace=False)
+            aberrants = np.concatenate([[aberrants.min(), aberrants.max()], echantillon])
+
+        stats.append({x: categorie, "n": len(valeurs), "q1": q1, "mediane": mediane, "q3": q3,
+                      "moyenne": valeurs.mean(), "moustache_basse": dans_bornes.min(),
+                      "moustache_haute": dans_bornes.max(), "n_aberrants": n_aberrants,
+                      "aberrants": aberrants})
+
+    return pd.DataFrame(stats)
+
+
+def figure_boites(stats, x, y):
+    fig = go.Figure()
+    fig.add_trace(go.Box(x = stats[x], q1 = stats["q1"], median = stats["mediane"], q3 = stats["q3"],
+                         mean = stats["moyenne"], lowerfence = stats["moustache_basse"],
+                         upperfence = stats["moustache_haute"], name = y, showlegend = False))
+
+    x_aberrants = np.repeat(stats[x].to_numpy(), stats["aberrants"].map(len).to_numpy())
+    y_aberrants = np.concatenate(stats["aberrants"].to_list()) if len(stats) else []
+    fig.add_trace(go.Scatter(x = x_aberrants, y = y_aberrants, mode = "markers", name = "Valeurs aberrantes",
+                             marker = dict(size = 4), showlegend = False))
+
+    fig.update_layout(xaxis_title = x, yaxis_title = y)
+    return fig
+
+
+def figures_visualisation(df):
+    # Figures de la page Data Visualisation, construites une fois par jeu de données
+    df = df.assign(Carburant=df['Carburant'].replace(DICTIONNAIRE_CARBURANT).astype(object))
+
+    return {
+        "heatmap": figure_heatmap(df),
+        "nuage": figure_nuage(df),
+        "repartition": figure_repartition(df),
+        "boites": figure_boites(statistiques_boites(df, 'Carburant', 'CO2 (g/km)'), 'Carburant', 'CO2 (g/km)'),
+    }
+
+
+def version_visualisation():
+    # Empreinte du code des figures : une modification invalide les specs JSON
+    # mises en cache sur disque par l'application
+    contenu = json.dumps({"sources": [inspect.getsource(f) for f in (figure_heatmap, figure_nuage, figure_repartition,
+                                                                      statistiques_boites, figure_boites, figures_visualisation)],
+                          "carburants": DICTIONNAIRE_CARBURANT}, sort_keys=True)
+    return hashlib.sha1(contenu.encode()).hexdigest()[:8]